@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    from execution.block_manifest import load_manifest, write_manifest
+    from execution.file_integrity import mp4_duration
+    from execution.queue_lease import item_key
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from block_manifest import load_manifest, write_manifest
+    from file_integrity import mp4_duration
+    from queue_lease import item_key
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+CATALOG_FILE = os.path.join(OUTPUT_ROOT, "catalog.db")
+DOWNLOADS_DIR = os.path.join(OUTPUT_ROOT, "downloads")
+QUEUE_FILE = os.path.join(OUTPUT_ROOT, "download_queue.json")
+STATUS_FILE = os.path.join(OUTPUT_ROOT, "download_status.json")
+
+HASH_WORKERS = 4  # Parallel checksums when importing an existing archive
+BUSY_TIMEOUT = 30  # Seconds to wait for another worker's write to finish
+
+# One row per queue item (keyed like the leases and results), plus an
+# external-content FTS5 index over the text columns kept in sync by triggers.
+# SQLite's locking is not reliable on network shares (neither the rollback
+# journal nor WAL), so the catalog has a single writer per run: the parser,
+# an unsharded downloader or watch mode. Shard workers leave it alone and it is
+# filled from the merged download_status.json by `import` after the run.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    key TEXT PRIMARY KEY,
+    course TEXT,
+    module TEXT,
+    title TEXT,
+    type TEXT,
+    url TEXT,
+    path TEXT,
+    size INTEGER,
+    duration REAL,
+    checksum TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    discovered REAL,
+    seen REAL,
+    downloaded REAL
+);
+CREATE INDEX IF NOT EXISTS items_course_status ON items (course, status);
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, course, module, content='items', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, course, module) VALUES (new.rowid, new.title, new.course, new.module);
+END;
+CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, course, module) VALUES ('delete', old.rowid, old.title, old.course, old.module);
+END;
+CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE OF title, course, module ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, course, module) VALUES ('delete', old.rowid, old.title, old.course, old.module);
+    INSERT INTO items_fts (rowid, title, course, module) VALUES (new.rowid, new.title, new.course, new.module);
+END;
+"""
+
+# "Lecture 3 (12:34)" -> 754 seconds
+TITLE_DURATION_PATTERN = re.compile(r"\((?:(\d+):)?(\d+):(\d{2})\)")
+TYPE_FOLDERS = ("videos", "pdfs")
+
+# Catalog files whose schema this process already created or checked
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+@contextmanager
+def open_catalog(path=CATALOG_FILE):
+    """Connection to the catalog (created on first use); commits on success and always closes."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    try:
+        with _schema_lock:
+            if path not in _schema_ready:
+                conn.executescript(SCHEMA)
+                _schema_ready.add(path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def item_location(item):
+    """(course, module path) of a queue item from its target_dir, e.g. ('CS 101', 'Week 1/Lectures')."""
+    target_dir = item.get("target_dir") or ""
+    if not os.path.isabs(target_dir):
+        target_dir = os.path.join(OUTPUT_ROOT, target_dir)
+    rel = os.path.relpath(target_dir, DOWNLOADS_DIR)
+    if rel.startswith(".."):
+        return "unknown", ""
+    parts = rel.split(os.sep)
+    if parts[-1] in TYPE_FOLDERS:
+        parts = parts[:-1]
+    return parts[0], "/".join(parts[1:])
+
+
+def title_duration(title):
+    """Duration in seconds from a '(mm:ss)' / '(h:mm:ss)' suffix in the link text, or None."""
+    match = TITLE_DURATION_PATTERN.search(title or "")
+    if not match:
+        return None
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def file_checksum(path):
+    """
+    SHA-256 of a local file, or None for objects and missing files. Taken
+    from the block manifest written during the download when it is current;
+    otherwise the file is hashed once and its manifest written for replication.
+    """
+    if not path or not os.path.isfile(path):
+        return None
+    manifest = load_manifest(path) or write_manifest(path)
+    return manifest["sha256"]
+
+
+def _discovered_row(item, now):
+    course, module = item_location(item)
+    return (item_key(item), course, module, item.get("title"), item.get("type", "video"),
+            item.get("url"), title_duration(item.get("title")), now, now)
+
+
+def record_discovered(items, path=CATALOG_FILE):
+    """
+    Adds or refreshes queue items found by the parser. Download results of
+    known items are kept; `seen` marks when an item was last on the course page.
+    """
+    now = time.time()
+    try:
+        with open_catalog(path) as conn:
+            conn.executemany(
+                """
+                INSERT INTO items (key, course, module, title, type, url, duration, discovered, seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    course = excluded.course, module = excluded.module, title = excluded.title,
+                    type = excluded.type, url = excluded.url,
+                    duration = COALESCE(items.duration, excluded.duration), seen = excluded.seen
+                """,
+                [_discovered_row(item, now) for item in items],
+            )
+        print(f"Catalog: {len(items)} items recorded in {path}.")
+    except sqlite3.Error as e:
+        print(f"  [CATALOG] Could not record discovered items: {e}")
+
+
+def _download_rows(item, status, file_path, size=None, now=None):
+    """
+    (insert, update) parameters for one download result. Finished local
+    files get their checksum and, for MP4s, the duration from the movie header.
+    """
+    checksum = duration = None
+    if status == "done" and file_path and os.path.isfile(file_path):
+        checksum = file_checksum(file_path)
+        if file_path.lower().endswith(".mp4"):
+            duration = mp4_duration(file_path)
+    now = now or time.time()
+    return _discovered_row(item, now), (status, file_path, size, checksum, duration, status, now, item_key(item))
+
+
+def write_downloads(rows, path=CATALOG_FILE):
+    """Writes (insert, update) rows from _download_rows in one transaction."""
+    with open_catalog(path) as conn:
+        conn.executemany(
+            """
+            INSERT INTO items (key, course, module, title, type, url, duration, discovered, seen)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO NOTHING
+            """,
+            [insert for insert, _ in rows],
+        )
+        conn.executemany(
+            """
+            UPDATE items SET
+                status = ?, path = COALESCE(?, path), size = COALESCE(?, size),
+                checksum = COALESCE(?, checksum), duration = COALESCE(?, duration),
+                downloaded = CASE WHEN ? = 'done' THEN ? ELSE downloaded END
+            WHERE key = ?
+            """,
+            [update for _, update in rows],
+        )
+
+
+def record_downloads(results, path=CATALOG_FILE):
+    """Records (item, status, file path, size) download results in one transaction."""
+    rows = [_download_rows(*result) for result in results]
+    if not rows:
+        return
+    try:
+        write_downloads(rows, path)
+    except sqlite3.Error as e:
+        what = results[0][0].get("title") if len(results) == 1 else f"{len(results)} download results"
+        print(f"  [CATALOG] Could not record {what}: {e}")
+
+
+def record_download(item, status, file_path, size=None, path=CATALOG_FILE):
+    """Records the result of one download."""
+    record_downloads([(item, status, file_path, size)], path)
+
+
+def fts_query(text):
+    """Turns free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(conn, text=None, course=None, item_type=None, status=None, limit=50):
+    """Items matching `text` (ranked by relevance) and the optional filters."""
+    where, params = [], []
+    if course:
+        where.append("items.course LIKE ?")
+        params.append(f"%{course}%")
+    if item_type:
+        where.append("items.type = ?")
+        params.append(item_type)
+    if status:
+        where.append("items.status = ?")
+        params.append(status)
+
+    if text and fts_query(text):
+        sql = "SELECT items.* FROM items_fts JOIN items ON items.rowid = items_fts.rowid WHERE items_fts MATCH ?"
+        params.insert(0, fts_query(text))
+        order = "bm25(items_fts)"
+    else:
+        sql = "SELECT items.* FROM items WHERE 1"
+        order = "items.course, items.module, items.title"
+    for clause in where:
+        sql += f" AND {clause}"
+    sql += f" ORDER BY {order} LIMIT ?"
+    return conn.execute(sql, params + [limit]).fetchall()
+
+
+def missing(conn, course=None, verify=False):
+    """
+    Items that are not downloaded, by course. With `verify`, items recorded
+    as done whose file is gone count as missing too (one stat per file).
+    """
+    params = [f"%{course}%"] if course else []
+    course_filter = " AND course LIKE ?" if course else ""
+    rows = conn.execute(
+        f"SELECT * FROM items WHERE status != 'done'{course_filter} ORDER BY course, module, title", params
+    ).fetchall()
+    if verify:
+        done = conn.execute(f"SELECT * FROM items WHERE status = 'done'{course_filter}", params).fetchall()
+        rows += [
+            row for row in done
+            if row["path"] and not row["path"].startswith("s3://") and not os.path.exists(row["path"])
+        ]
+    return rows
+
+
+def format_size(n):
+    if n is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def format_length(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def print_rows(rows, show_path=False):
+    for row in rows:
+        print(f"  {row['status']:<9} {row['type']:<5} {format_size(row['size']):>10} {format_length(row['duration']):>8}  "
+              f"{row['course'][:28]:<28} {row['module'][:30]:<30} {row['title']}")
+        if show_path and row["path"]:
+            print(f"            {row['path']}")
+
+
+def print_stats(conn):
+    rows = conn.execute(
+        """
+        SELECT course, type, COUNT(*) AS items,
+               SUM(status = 'done') AS done, SUM(size) AS size, SUM(duration) AS duration
+        FROM items GROUP BY course, type ORDER BY course, type
+        """
+    ).fetchall()
+    print(f"{'Course':<30} {'Type':<5} {'Done':>11} {'Size':>10} {'Length':>9}")
+    for row in rows:
+        print(f"{row['course'][:30]:<30} {row['type']:<5} {row['done']:>5}/{row['items']:<5} "
+              f"{format_size(row['size']):>10} {format_length(row['duration']):>9}")
+
+
+def import_existing(path=CATALOG_FILE, queue_file=QUEUE_FILE, status_file=STATUS_FILE, workers=HASH_WORKERS):
+    """
+    Fills the catalog from download_queue.json and download_status.json of
+    earlier runs or of a sharded run, hashing the finished files in parallel
+    and writing them in one transaction.
+    """
+    with open(queue_file, "r", encoding="utf-8") as f:
+        queue = json.load(f)
+    record_discovered(queue, path)
+
+    status = {}
+    if os.path.exists(status_file):
+        with open(status_file, "r", encoding="utf-8") as f:
+            status = json.load(f)
+    results = [(item, status[item_key(item)]) for item in queue if status.get(item_key(item), {}).get("status") not in (None, "pending")]
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(lambda r: _download_rows(r[0], r[1]["status"], r[1].get("path"), r[1].get("size")), results))
+    if rows:
+        write_downloads(rows, path)
+    print(f"Imported {len(results)} download results in {time.time() - started:.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the archive catalog (catalog.db) kept up to date by the parser and downloader.")
+    parser.add_argument("--catalog", default=CATALOG_FILE, help="Catalog database (default: catalog.db in the output root).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    find = commands.add_parser("search", help="Full-text search over titles, courses and module names.")
+    find.add_argument("text", nargs="?", help="Words to look for (prefix match), e.g. 'lecture 5 recursion'.")
+    find.add_argument("--course", help="Only courses whose name contains this.")
+    find.add_argument("--type", choices=["video", "pdf"], help="Only this item type.")
+    find.add_argument("--status", choices=["done", "failed", "postponed", "pending"], help="Only items with this status.")
+    find.add_argument("--limit", type=int, default=50, help="Maximum results (default: 50).")
+    find.add_argument("--paths", action="store_true", help="Also print the file path of each result.")
+
+    gaps = commands.add_parser("missing", help="Items discovered but not downloaded.")
+    gaps.add_argument("--course", help="Only courses whose name contains this.")
+    gaps.add_argument("--verify", action="store_true", help="Also list downloaded items whose file no longer exists.")
+
+    commands.add_parser("stats", help="Items, downloads, size and length per course.")
+
+    backfill = commands.add_parser("import", help="Fill the catalog from download_queue.json and download_status.json.")
+    backfill.add_argument("--workers", type=int, default=HASH_WORKERS, help="Files hashed in parallel (default: 4).")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import_existing(args.catalog, workers=args.workers)
+        return
+
+    started = time.perf_counter()
+    with open_catalog(args.catalog) as conn:
+        if args.command == "search":
+            rows = search(conn, args.text, args.course, args.type, args.status, args.limit)
+            print_rows(rows, args.paths)
+        elif args.command == "missing":
+            rows = missing(conn, args.course, args.verify)
+            print_rows(rows)
+        else:
+            print_stats(conn)
+            rows = None
+    if rows is not None:
+        print(f"\n{len(rows)} items ({(time.perf_counter() - started) * 1000:.1f} ms).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import time
+from http.cookies import SimpleCookie
+
+import aiohttp
+
+try:
+    from execution.block_manifest import BlockHasher, load_manifest, resume_hasher, write_manifest
+    from execution.driver_utils import is_login_page
+    from execution.file_integrity import COMPLETE, PART_SUFFIX, check_file
+    from execution.kaltura_video_extractor import USER_AGENT
+    from execution.queue_lease import global_slot_async
+    from execution.retry_policy import SessionExpiredError, backoff_delay, classify_error, should_retry
+except ImportError:
+    from block_manifest import BlockHasher, load_manifest, resume_hasher, write_manifest
+    from driver_utils import is_login_page
+    from file_integrity import COMPLETE, PART_SUFFIX, check_file
+    from kaltura_video_extractor import USER_AGENT
+    from queue_lease import global_slot_async
+    from retry_policy import SessionExpiredError, backoff_delay, classify_error, should_retry
+
+# Transfers in flight at once. Small files are latency bound, so many
+# concurrent requests over a shared connection pool hide the round trips.
+MAX_IN_FLIGHT = 200
+# Connections to a single host (Brightspace serves all course files)
+PER_HOST_LIMIT = 64
+CHUNK_SIZE = 64 * 1024
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=30, sock_read=60)
+
+
+class TransferCancelled(Exception):
+    """The job's owner gave it up (e.g. its lease was lost); nothing more is written."""
+
+
+def _content_length(response):
+    if response.headers.get("Content-Length") and "gzip" not in response.headers.get("Content-Encoding", ""):
+        return int(response.headers["Content-Length"])
+    return None
+
+
+async def remote_size(session, url):
+    """Async counterpart of kaltura_video_extractor.remote_size (HEAD, then zero-length Range)."""
+    try:
+        async with session.head(url, allow_redirects=True) as r:
+            if r.ok and _content_length(r) is not None:
+                return _content_length(r)
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as r:
+            content_range = r.headers.get("Content-Range", "")
+            if r.status == 206 and "/" in content_range and not content_range.endswith("*"):
+                return int(content_range.rsplit("/", 1)[1])
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        pass
+    return None
+
+
+async def download_file(session, url, filename, cancelled=None):
+    """
+    Async counterpart of kaltura_video_extractor.download_file with the same
+    semantics: complete files are skipped, data goes to `{filename}.part`
+    (resumed with Range if present) and is renamed into place only after the
+    size and file structure verify. Once `cancelled()` returns True no more
+    data is written and TransferCancelled is raised.
+    """
+    if os.path.exists(filename):
+        state = check_file(filename, await remote_size(session, url))
+        if state == COMPLETE:
+            print(f"  Already downloaded, skipping: {filename}")
+            if load_manifest(filename) is None:
+                # Downloaded before manifests existed, or changed since; hashed off the event loop
+                await asyncio.to_thread(write_manifest, filename)
+            return filename
+        print(f"  Existing file is {state}, downloading again: {filename}")
+        os.remove(filename)
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    part_path = filename + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    hasher = None
+
+    async with session.get(url, headers=headers) as r:
+        if is_login_page(str(r.url)):
+            raise SessionExpiredError(f"Download redirected to {r.url}")
+        if not (offset and r.status == 416):  # 416: the part file already holds every byte
+            r.raise_for_status()
+            if offset and r.status != 206:
+                offset = 0
+
+            expected = _content_length(r)
+            if expected is not None:
+                expected += offset
+
+            # These are small files, so plain blocking writes of each chunk are
+            # cheaper than handing them to a thread.
+            hasher = resume_hasher(part_path) if offset else BlockHasher()
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                    if cancelled is not None and cancelled():
+                        raise TransferCancelled(f"Cancelled: {filename}")
+                    f.write(chunk)
+                    hasher.update(chunk)
+
+            written = os.path.getsize(part_path)
+            if expected is not None and written != expected:
+                raise IOError(f"Incomplete download: got {written} of {expected} bytes")
+
+    if cancelled is not None and cancelled():
+        raise TransferCancelled(f"Cancelled: {filename}")
+    state = check_file(part_path, ext=os.path.splitext(filename)[1])
+    if state != COMPLETE:
+        os.remove(part_path)
+        raise IOError(f"Downloaded file failed verification ({state}): {filename}")
+    os.replace(part_path, filename)
+    write_manifest(filename, hasher)
+    return filename
+
+
+async def _acquire(semaphore, controller):
+    if controller is not None:
+        await controller.acquire_async()
+    else:
+        await semaphore.acquire()
+
+
+def _release(semaphore, controller):
+    if controller is not None:
+        controller.release()
+    else:
+        semaphore.release()
+
+
+async def _download_with_retries(session, semaphore, job, on_start, on_done, controller=None, cancelled=None):
+    await _acquire(semaphore, controller)
+    try:
+        if on_start and not on_start(job):
+            return
+        is_cancelled = (lambda: cancelled(job)) if cancelled else None
+        attempt = 0
+        started = time.time()
+        while True:
+            if is_cancelled is not None and is_cancelled():
+                path, error, error_class = None, TransferCancelled(f"Cancelled: {job['filename']}"), "cancelled"
+                break
+            attempt += 1
+            # Bytes already on disk are not transferred again; skipped files do
+            # not count as throughput at all.
+            part_path = job["filename"] + PART_SUFFIX
+            skipped = os.path.exists(job["filename"])
+            before = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            attempt_started = time.time()
+            try:
+                # One global slot per transfer (multi_account.py), not held while backing off
+                async with global_slot_async():
+                    attempt_started = time.time()  # Waiting for the slot is not transfer time
+                    path = await download_file(session, job["media_url"], job["filename"], is_cancelled)
+                error, error_class = None, None
+                if controller is not None and not skipped:
+                    controller.record(time.time() - attempt_started, os.path.getsize(path) - before)
+                break
+            except TransferCancelled as e:
+                path, error, error_class = None, e, "cancelled"
+                break
+            except Exception as e:
+                error_class = classify_error(e)
+                if controller is not None:
+                    controller.record(time.time() - attempt_started, signal=error_class)
+                if not should_retry(error_class, attempt):
+                    path, error = None, e
+                    break
+                # Give the slot back while backing off
+                _release(semaphore, controller)
+                try:
+                    await asyncio.sleep(backoff_delay(error_class, attempt))
+                finally:
+                    await _acquire(semaphore, controller)
+    finally:
+        _release(semaphore, controller)
+
+    if on_done:
+        on_done(job, path, error, error_class, attempt, time.time() - started)
+
+
+def _cookie_jar(cookies):
+    """Builds an aiohttp cookie jar from Selenium-style cookie dicts."""
+    jar = aiohttp.CookieJar()
+    for cookie in cookies or []:
+        morsel = SimpleCookie()
+        morsel[cookie["name"]] = cookie["value"]
+        if cookie.get("domain"):
+            morsel[cookie["name"]]["domain"] = cookie["domain"]
+        jar.update_cookies(morsel)
+    return jar
+
+
+async def download_all(jobs, cookies=None, max_in_flight=MAX_IN_FLIGHT, on_start=None, on_done=None, controller=None, cancelled=None):
+    """
+    Downloads every job ({"media_url", "filename", ...}) with at most
+    `max_in_flight` transfers running, all sharing one connection pool.
+    With an AIMD `controller` the number of transfers adapts between 1 and
+    `max_in_flight` instead.
+    on_start(job) may return False to skip a job (e.g. lease not obtained);
+    on_done(job, path, error, error_class, attempts, seconds) is called per job.
+    Once cancelled(job) returns True the job stops writing and finishes with
+    TransferCancelled (error class "cancelled").
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    connector = aiohttp.TCPConnector(limit=max_in_flight, limit_per_host=PER_HOST_LIMIT)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        cookie_jar=_cookie_jar(cookies),
+        headers={"User-Agent": USER_AGENT},
+        timeout=REQUEST_TIMEOUT,
+    ) as session:
+        await asyncio.gather(*(
+            _download_with_retries(session, semaphore, job, on_start, on_done, controller, cancelled) for job in jobs
+        ))
+
+
+def run_downloads(jobs, cookies=None, max_in_flight=MAX_IN_FLIGHT, on_start=None, on_done=None, controller=None, cancelled=None):
+    """Synchronous entry point for download_all."""
+    mode = f"adaptively (start {int(controller.limit)}, max {max_in_flight})" if controller else f"with up to {max_in_flight}"
+    print(f"\n[ASYNC] Downloading {len(jobs)} files {mode} in flight...")
+    started = time.time()
+    asyncio.run(download_all(jobs, cookies, max_in_flight, on_start, on_done, controller, cancelled))
+    print(f"[ASYNC] Finished in {time.time() - started:.1f}s")
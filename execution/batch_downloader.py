@@ -1,31 +1,459 @@
+import argparse
 import json
 import os
 import sys
+import threading
 import time
 
+import requests
+
 try:
+    from execution.archive_catalog import record_download, record_downloads
+    from execution.async_downloader import MAX_IN_FLIGHT, run_downloads
+    from execution.concurrency_controller import METRICS_FILE, AIMDController
     from execution.driver_utils import (
+        LoginRequiredError,
+        is_login_page,
         load_brightspace_cookies,
         setup_driver,
         validate_and_refresh_session,
     )
+    from execution.file_integrity import COMPLETE
     from execution.kaltura_video_extractor import (
+        download_file,
         extract_and_download,
         extract_pdf_content,
+        make_session,
+    )
+    from execution.object_storage import S3, check_stored, storage_backend, stored_size
+    from execution.preflight import (
+        DEFAULT_DISK_RESERVE,
+        RESOLVE_WORKERS,
+        apply_preflight,
+        item_target_dir,
+        load_preflight,
+        probe_sizes,
+        resolve_items,
+        resolve_pdfs_direct,
+        run_preflight,
+        save_preflight,
+    )
+    from execution.queue_lease import (
+        DEFAULT_LEASE_TTL,
+        LEASE_DIR,
+        RESULTS_DIR,
+        STATUS_FILE,
+        default_worker_id,
+        discard_results,
+        is_done,
+        item_key,
+        load_results,
+        merge_results,
+        record_result,
+        release,
+        reset_leases,
+        start_heartbeat,
+        try_claim,
     )
+    from execution.retry_policy import (
+        RETRY_POLICIES,
+        SegmentNotFoundError,
+        SessionExpiredError,
+        backoff_delay,
+        classify_error,
+        load_retry_queue,
+        save_retry_queue,
+        should_retry,
+    )
+    from execution.scheduler import DEFAULT_QUANTUM_MB, fair_order, parse_weights, print_schedule
+    from execution.tenant_config import LOGIN_REQUIRED_EXIT, OUTPUT_ROOT, get_tenant
+    from execution.webdriver_profiler import enable_profiling, print_profile_summary
 except ImportError:
+    from archive_catalog import record_download, record_downloads
+    from async_downloader import MAX_IN_FLIGHT, run_downloads
+    from concurrency_controller import METRICS_FILE, AIMDController
     from driver_utils import (
+        LoginRequiredError,
+        is_login_page,
         load_brightspace_cookies,
         setup_driver,
         validate_and_refresh_session,
     )
-    from kaltura_video_extractor import extract_and_download, extract_pdf_content
+    from file_integrity import COMPLETE
+    from kaltura_video_extractor import (
+        download_file,
+        extract_and_download,
+        extract_pdf_content,
+        make_session,
+    )
+    from object_storage import S3, check_stored, storage_backend, stored_size
+    from preflight import (
+        DEFAULT_DISK_RESERVE,
+        RESOLVE_WORKERS,
+        apply_preflight,
+        item_target_dir,
+        load_preflight,
+        probe_sizes,
+        resolve_items,
+        resolve_pdfs_direct,
+        run_preflight,
+        save_preflight,
+    )
+    from queue_lease import (
+        DEFAULT_LEASE_TTL,
+        LEASE_DIR,
+        RESULTS_DIR,
+        STATUS_FILE,
+        default_worker_id,
+        discard_results,
+        is_done,
+        item_key,
+        load_results,
+        merge_results,
+        record_result,
+        release,
+        reset_leases,
+        start_heartbeat,
+        try_claim,
+    )
+    from retry_policy import (
+        RETRY_POLICIES,
+        SegmentNotFoundError,
+        SessionExpiredError,
+        backoff_delay,
+        classify_error,
+        load_retry_queue,
+        save_retry_queue,
+        should_retry,
+    )
+    from scheduler import DEFAULT_QUANTUM_MB, fair_order, parse_weights, print_schedule
+    from tenant_config import LOGIN_REQUIRED_EXIT, OUTPUT_ROOT, get_tenant
+    from webdriver_profiler import enable_profiling, print_profile_summary
+
+# Output Root Setup
+QUEUE_FILE = os.path.join(OUTPUT_ROOT, "download_queue.json")
+
+# Lease keys of the passes that one shard worker runs for the whole job
+PREFLIGHT_LEASE = "preflight"
+SCHEDULE_LEASE = "schedule-sizes"
+
+
+def process_item(driver, item):
+    """Downloads a single queue item. Returns the downloaded file path, raises on failure."""
+    url = item.get("url")
+    # Fix relative paths to be absolute relative to OUTPUT_ROOT
+    target_dir = item_target_dir(item)
+
+    print(f"Target: {target_dir}")
+
+    # A pre-flight pass already resolved the media URL: skip the page load
+    if item.get("media_url") and item.get("filename"):
+        try:
+            return download_file(make_session(driver), item["media_url"], item["filename"])
+        except requests.HTTPError as e:
+            if e.response is None or not 400 <= e.response.status_code < 500:
+                raise
+            print(f"  Resolved URL was rejected ({e.response.status_code}), resolving again...")
+
+    item_type = item.get("type", "video") # Default to video for backward compatibility
+    if item_type == "pdf":
+        path = extract_pdf_content(driver, url, target_dir)
+    else:
+        path = extract_and_download(driver, url, target_dir)
+    if not path:
+        if is_login_page(driver.current_url):
+            raise SessionExpiredError(f"Redirected to login while loading {url}")
+        if item_type == "pdf":
+            raise RuntimeError(f"No PDF could be extracted from {url}")
+        raise SegmentNotFoundError(f"No segment URL found on {url}")
+    return path
+
+
+def refresh_session(driver):
+    """Reloads the homepage and re-authenticates if we land on the login page."""
+    driver.get(get_tenant()["home_url"])
+    return validate_and_refresh_session(driver)
+
+
+def process_with_retries(driver, item, lease_lost=None):
+    """
+    Processes an item, retrying failures according to the policy of their
+    error class. Returns (driver, path, error_class, error, attempts); the
+    driver may have been replaced by a session refresh. Once `lease_lost` is
+    set no further attempt is started.
+    """
+    attempt = 0
+    while True:
+        if lease_lost is not None and lease_lost.is_set():
+            return driver, None, None, None, attempt
+        attempt += 1
+        try:
+            return driver, process_item(driver, item), None, None, attempt
+        except Exception as e:
+            error_class = classify_error(e)
+            if not should_retry(error_class, attempt):
+                return driver, None, error_class, e, attempt
+
+            delay = backoff_delay(error_class, attempt)
+            print(f"  [RETRY] {error_class}: {e}. Attempt {attempt + 1}/{RETRY_POLICIES[error_class]['attempts']} in {delay:.0f}s...")
+            time.sleep(delay)
+            if RETRY_POLICIES[error_class].get("refresh_session"):
+                driver = refresh_session(driver)
+
+
+def already_complete(previous):
+    """
+    True if an earlier run recorded this item as done and the file it wrote is
+    still complete. Costs one stat plus a few header reads, no page load.
+    """
+    if not previous or previous.get("status") != "done" or not previous.get("path"):
+        return False
+    return check_stored(previous["path"], previous.get("size")) == COMPLETE
+
+
+def run_item(driver, item, label, worker_id, results_dir, previous=None, lease_lost=None, catalog=True):
+    """
+    Processes one item and records its result (in the catalog too unless
+    `catalog` is False). Returns (driver, status).
+    If the item's lease is lost meanwhile (`lease_lost` set by the heartbeat),
+    the item is dropped without a result and the status is None.
+    """
+    title = item.get("title")
+    key = item_key(item)
+    previous = (previous or {}).get(key)
+
+    if already_complete(previous):
+        print(f"\n{label} Skipping (already complete): {title}")
+        return driver, "done"
+
+    print(f"\n{label} Processing: {title}")
+    started = time.time()
+    driver, path, error_class, error, attempts = process_with_retries(driver, item, lease_lost)
+    if lease_lost is not None and lease_lost.is_set():
+        # The worker that reclaimed the item records its result
+        print(f"{label} Lost the lease of {title}, dropping it.")
+        return driver, None
+    if error is None:
+        status = "done"
+    else:
+        print(f"Error downloading {title} ({error_class}, {attempts} attempts): {error}")
+        status = "failed"
+
+    record = result_record(item, status, path, error, error_class, attempts, time.time() - started)
+    record_result(results_dir, worker_id, key, record)
+    if catalog:
+        record_download(item, status, path, record["size"])
+    return driver, status
+
+
+def result_record(item, status, path, error, error_class, attempts, seconds):
+    return {
+        "title": item.get("title"),
+        "url": item.get("url"),
+        "status": status,
+        "error": str(error) if error else None,
+        "error_class": error_class,
+        "attempts": attempts,
+        "path": path,
+        "size": stored_size(path),
+        "seconds": round(seconds, 2),
+    }
+
+
+def run_async_pdfs(driver, queue, args, previous, controllers=None):
+    """
+    Resolves all pending PDF items and downloads them concurrently through the
+    async engine. Returns the items that still need the synchronous path
+    (videos and PDFs that could not be resolved or failed).
+    """
+    if storage_backend() == S3:
+        # The async engine writes local files only
+        print("[ASYNC] Not available with STORAGE_BACKEND=s3; PDFs use the synchronous path.")
+        return queue
+
+    pdf_items = [
+        item for item in queue
+        if item.get("type") == "pdf" and not already_complete(previous.get(item_key(item)))
+    ]
+    if not pdf_items:
+        return queue
+
+    controllers = controllers or {}
+    resolve_items(driver, pdf_items, controllers.get("resolve"))
+    jobs = [item for item in pdf_items if item.get("media_url") and item.get("filename")]
+    finished = set()
+    downloads = []  # Recorded in the catalog after the pass, not from the event loop
+    heartbeats = {}  # item key -> (stop, lost) events of the leases held by running jobs
+
+    def on_start(item):
+        if not args.shard:
+            return True
+        key = item_key(item)
+        if not try_claim(args.lease_dir, key, args.worker_id, args.lease_ttl):
+            return False
+        # A job can wait out backoffs and slow transfers longer than the TTL
+        lost = threading.Event()
+        heartbeats[key] = (start_heartbeat(args.lease_dir, key, args.worker_id, args.lease_ttl, lost), lost)
+        return True
+
+    def lease_lost(item):
+        _, lost = heartbeats.get(item_key(item), (None, None))
+        return lost is not None and lost.is_set()
+
+    def on_done(item, path, error, error_class, attempts, seconds):
+        key = item_key(item)
+        stop, lost = heartbeats.pop(key, (None, None))
+        if stop is not None:
+            stop.set()
+        if lost is not None and lost.is_set():
+            # The worker that reclaimed the item records its result
+            print(f"[ASYNC] Lost the lease of {item.get('title')}, dropping it.")
+            return
+        status = "done" if error is None else "failed"
+        if error:
+            print(f"[ASYNC] Error downloading {item.get('title')} ({error_class}): {error}")
+        else:
+            finished.add(key)
+        record = result_record(item, status, path, error, error_class, attempts, seconds)
+        record_result(args.results_dir, args.worker_id, key, record)
+        downloads.append((item, status, path, record["size"]))
+        if args.shard:
+            # Failed items stay claimable so the synchronous pass can retry them
+            release(args.lease_dir, key, args.worker_id, status="done" if status == "done" else None)
+
+    try:
+        run_downloads(jobs, driver.get_cookies(), args.max_in_flight, on_start, on_done, controllers.get("transfer"), lease_lost)
+    finally:
+        if not args.shard:
+            # Shard workers leave the catalog to `archive_catalog.py import`
+            record_downloads(downloads)
+    print(f"[ASYNC] {len(finished)} of {len(pdf_items)} PDFs downloaded.")
+    return [item for item in queue if item_key(item) not in finished]
+
+
+def record_postponed(items, worker_id, results_dir):
+    """Records items refused by pre-flight admission so they go to the retry queue."""
+    for item in items:
+        record_result(results_dir, worker_id, item_key(item), {
+            "title": item.get("title"),
+            "url": item.get("url"),
+            "status": "postponed",
+            "error": "Not enough free disk space",
+            "error_class": "disk_full",
+            "attempts": 0,
+            "size": item.get("size"),
+        })
+
+
+def order_queue(queue, retry_queue):
+    """Puts items from the retry queue first, without duplicating them."""
+    retry_keys = {item_key(item) for item in retry_queue}
+    return list(retry_queue) + [item for item in queue if item_key(item) not in retry_keys]
+
+
+def run_once(args, queue, key, work):
+    """
+    Runs `work`, a pass that resolves and sizes queue items and saves them to
+    preflight.json. In shard mode only the worker that claims the lease `key`
+    runs it, once per job; the others wait for it and copy its results onto
+    their queue from preflight.json. Returns True if this worker ran it.
+    """
+    if not args.shard:
+        work()
+        return True
+    while not is_done(args.lease_dir, key):
+        if try_claim(args.lease_dir, key, args.worker_id, args.lease_ttl):
+            lost = threading.Event()
+            stop_heartbeat = start_heartbeat(args.lease_dir, key, args.worker_id, args.lease_ttl, lost)
+            try:
+                work()
+            except BaseException:
+                release(args.lease_dir, key, args.worker_id)
+                raise
+            finally:
+                stop_heartbeat.set()
+            release(args.lease_dir, key, args.worker_id, status="done")
+            return True
+        print(f"[SHARD] Waiting for another worker's {key} pass...")
+        time.sleep(min(30, args.lease_ttl / 4))
+    apply_preflight(queue, load_preflight())
+    return False
+
+
+def run_sharded(driver, queue, worker_id, lease_dir, results_dir, ttl, previous=None):
+    """
+    Works through the shared queue together with other workers. Each item is
+    claimed through a lease first; items whose lease expired (crashed worker)
+    are picked up again on a later pass. Only finished items get a done
+    marker: failed ones stay claimable for the retry queue of the next run,
+    and are not tried again by this worker in this run. Results go to the
+    worker's results file only; SQLite cannot be shared safely over a network
+    share, so the catalog is filled by `archive_catalog.py import` afterwards.
+    Returns the (possibly refreshed) driver.
+    """
+    failed = set()
+    while True:
+        claimed = 0
+        for i, item in enumerate(queue):
+            key = item_key(item)
+            if key in failed or not try_claim(lease_dir, key, worker_id, ttl):
+                continue
+
+            claimed += 1
+            lease_lost = threading.Event()
+            stop_heartbeat = start_heartbeat(lease_dir, key, worker_id, ttl, lease_lost)
+            try:
+                driver, status = run_item(driver, item, f"[{i+1}/{len(queue)}]", worker_id, results_dir, previous, lease_lost, catalog=False)
+            finally:
+                stop_heartbeat.set()
+            if status == "failed":
+                failed.add(key)
+            if status is not None:
+                release(lease_dir, key, worker_id, status="done" if status == "done" else None)
+
+        pending = [item for item in queue if item_key(item) not in failed and not is_done(lease_dir, item_key(item))]
+        if not pending:
+            break
+        if not claimed:
+            # Everything left is leased by other workers. Wait and re-check so
+            # leases of workers that died in the meantime get reclaimed.
+            print(f"[SHARD] {len(pending)} items leased by other workers. Waiting...")
+            time.sleep(min(30, ttl / 4))
+    return driver
 
-# Project Root Setup
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-QUEUE_FILE = os.path.join(PROJECT_ROOT, "download_queue.json")
 
 def main():
+    parser = argparse.ArgumentParser(description="Download all items in download_queue.json.")
+    parser.add_argument("--shard", action="store_true", help="Share the queue with other workers through leases in --lease-dir.")
+    parser.add_argument("--worker-id", default=default_worker_id(), help="Unique name of this worker (default: host-pid).")
+    parser.add_argument("--lease-dir", default=LEASE_DIR, help="Shared directory for item leases (e.g. on the NFS export).")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Shared directory for per-worker result files.")
+    parser.add_argument("--lease-ttl", type=int, default=DEFAULT_LEASE_TTL, help="Seconds before a lease of a silent worker expires.")
+    parser.add_argument("--reset-leases", action="store_true", help="Clear all leases and done markers before starting a new job.")
+    parser.add_argument("--preflight", action="store_true", help="Resolve and size all items first; postpone items that do not fit on disk.")
+    parser.add_argument("--preflight-only", action="store_true", help="Run the pre-flight pass, write preflight_summary.txt and exit.")
+    parser.add_argument("--async-pdfs", action="store_true", help="Download PDFs concurrently through the asyncio engine before the videos.")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT, help="Concurrent transfers for --async-pdfs (default: 200).")
+    parser.add_argument("--adaptive", action="store_true", help="Adapt PDF resolution and --async-pdfs transfer concurrency to the server (AIMD); --max-in-flight becomes the ceiling. Videos are not adapted: each worker downloads them one at a time.")
+    parser.add_argument("--disk-reserve", type=float, default=DEFAULT_DISK_RESERVE / 1024 ** 3, help="GiB of disk to keep free during pre-flight admission (default: 1).")
+    parser.add_argument("--schedule", choices=["queue", "fair"], default="queue", help="'queue': parser order. 'fair': interleave courses by size (deficit round robin).")
+    parser.add_argument("--course-weight", action="append", metavar="COURSE=WEIGHT", help="Throughput share of a course folder for --schedule fair (default 1; 0 = last). Repeatable.")
+    parser.add_argument("--type-priority", default="", help="Comma-separated item types to download first within a course, e.g. 'pdf,video'.")
+    parser.add_argument("--newest-first", action="store_true", help="Within a course, download the most recently added topics first.")
+    parser.add_argument("--quantum-mb", type=int, default=DEFAULT_QUANTUM_MB, help="MB of credit per course and round for --schedule fair (default: 256).")
+    parser.add_argument("--profile-webdriver", action="store_true", help="Count and time every WebDriver command and print a ranked summary at the end.")
+    args = parser.parse_args()
+    if args.profile_webdriver:
+        enable_profiling()
+
+    # AIMD controllers for the HTTP stages; decisions go to concurrency_metrics.jsonl
+    controllers = {}
+    if args.adaptive:
+        controllers = {
+            "resolve": AIMDController("resolve", initial=4, maximum=RESOLVE_WORKERS * 2, metrics_file=METRICS_FILE),
+            "transfer": AIMDController("transfer", initial=8, maximum=args.max_in_flight, metrics_file=METRICS_FILE),
+        }
+
     if not os.path.exists(QUEUE_FILE):
         print(f"Queue file '{QUEUE_FILE}' not found. Run brightspace_parser.py first.")
         sys.exit(1)
@@ -34,54 +462,108 @@ def main():
     with open(QUEUE_FILE, "r", encoding="utf-8") as f:
         queue = json.load(f)
 
+    # Items that failed last time go first
+    retry_queue = load_retry_queue()
+    if retry_queue:
+        print(f"Found {len(retry_queue)} items in the retry queue.")
+    queue = order_queue(queue, retry_queue)
+
     if not queue:
         print("Queue is empty.")
         return
 
     print(f"Found {len(queue)} items to download.")
-    
+    if args.reset_leases:
+        reset_leases(args.lease_dir)
+
     # Setup Driver (Headless!)
     print("Starting Headless Driver...")
     driver = setup_driver(headless=True)
-    
+
     try:
         load_brightspace_cookies(driver)
-        # load_brightspace_cookies already does driver.get("https://purdue.brightspace.com")
-        
+        # load_brightspace_cookies already navigates to the tenant's base URL
+
         # Validate Session
         driver = validate_and_refresh_session(driver)
-        
-        for i, item in enumerate(queue):
-            url = item.get("url")
-            target_dir = item.get("target_dir")
-            
-            # Fix relative paths to be absolute relative to PROJECT_ROOT
-            if target_dir and not os.path.isabs(target_dir):
-                # If path starts with "downloads", strip it to avoid duplication if we are already in root
-                # actually, simpler: just join PROJECT_ROOT with the path
-                target_dir = os.path.join(PROJECT_ROOT, target_dir)
-                
-            title = item.get("title")
-            
-            print(f"\n[{i+1}/{len(queue)}] Processing: {title}")
-            print(f"Target: {target_dir}")
-            
-            try:
-                item_type = item.get("type", "video") # Default to video for backward compatibility
-                
-                if item_type == "pdf":
-                    extract_pdf_content(driver, url, target_dir)
-                else:
-                    extract_and_download(driver, url, target_dir)
-            except Exception as e:
-                print(f"Error downloading {title}: {e}")
-                # Optional: mark as failed in a separate file? 
-                with open("failed_downloads.txt", "a", encoding="utf-8") as f:
-                    f.write(f"{title} | {url} | {e}\n")
+
+        # Results of earlier runs let finished items be skipped without a page load
+        previous = load_results(args.results_dir, STATUS_FILE)
+        apply_preflight(queue, load_preflight())
+        run_queue = queue
+
+        if args.preflight or args.preflight_only:
+            pending = [item for item in queue if not already_complete(previous.get(item_key(item)))]
+            print(f"\nPre-flight: {len(pending)} items still to download.")
+            reserve = int(args.disk_reserve * 1024 ** 3)
+            postponed = []
+
+            def preflight():
+                postponed.extend(run_preflight(driver, pending, previous, reserve, controllers.get("resolve"))[1])
+
+            ran = run_once(args, queue, PREFLIGHT_LEASE, preflight)
+            if not ran:
+                # Resolved and sized by another shard worker; only the disk admission runs here
+                postponed = run_preflight(driver, pending, previous, reserve, resolve=False)[1]
+            if args.preflight_only:
+                return
+            if ran:
+                # The other shard workers skip these items without recording them again
+                record_postponed(postponed, args.worker_id, args.results_dir)
+            postponed_keys = {item_key(item) for item in postponed}
+            run_queue = [item for item in queue if item_key(item) not in postponed_keys]
+
+        if args.async_pdfs:
+            run_queue = run_async_pdfs(driver, run_queue, args, previous, controllers)
+
+        if args.schedule == "fair":
+            # Sizes come from pre-flight; PDFs are resolved over HTTP and every
+            # resolved item without a size is HEAD-probed. Videos that were
+            # never resolved are scheduled with an estimate. Shard workers
+            # share one such pass through preflight.json.
+            pending = [item for item in run_queue if not already_complete(previous.get(item_key(item)))]
+
+            def size_pending():
+                session = make_session(driver)
+                resolve_pdfs_direct(session, pending, controller=controllers.get("resolve"))
+                probe_sizes(session, pending, controller=controllers.get("resolve"))
+                save_preflight(pending)
+
+            run_once(args, queue, SCHEDULE_LEASE, size_pending)
+            run_queue = fair_order(
+                run_queue,
+                weights=parse_weights(args.course_weight),
+                type_priority=[t.strip() for t in args.type_priority.split(",") if t.strip()],
+                newest_first=args.newest_first,
+                quantum_mb=args.quantum_mb,
+            )
+            print_schedule(run_queue)
+
+        if args.shard:
+            print(f"[SHARD] Running as worker '{args.worker_id}' (leases in {args.lease_dir})")
+            driver = run_sharded(driver, run_queue, args.worker_id, args.lease_dir, args.results_dir, args.lease_ttl, previous)
+        else:
+            for i, item in enumerate(run_queue):
+                driver, _ = run_item(driver, item, f"[{i+1}/{len(run_queue)}]", args.worker_id, args.results_dir, previous)
 
     finally:
         driver.quit()
+        status = merge_results(args.results_dir, STATUS_FILE, queue)
+        if not args.shard:
+            # Merged into download_status.json; shard workers keep theirs for the others' merges
+            discard_results(args.results_dir, args.worker_id)
+        save_retry_queue(status, queue)
+        if args.shard:
+            print("[SHARD] The catalog is not written by shard workers. Once all workers have finished, "
+                  "run 'python execution/archive_catalog.py import' on one node.")
         print("\nBatch download complete.")
+        for controller in controllers.values():
+            controller.print_summary()
+        print_profile_summary()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except LoginRequiredError as e:
+        print(f"Error: {e}")
+        sys.exit(LOGIN_REQUIRED_EXIT)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import mmap
+import os
+import socket
+
+# Every downloaded file gets a sidecar manifest `{file}.blocks.json` with one
+# hash per fixed-size block plus a SHA-256 of the whole file. Replicas compare
+# manifests and copy only the blocks that differ (see replicate_archive.py).
+MANIFEST_SUFFIX = ".blocks.json"
+MANIFEST_VERSION = 1
+BLOCK_SIZE = 4 * 1024 * 1024
+READ_CHUNK = 1024 * 1024
+
+
+def _block_hash():
+    # BLAKE2b is faster than SHA-256 in CPython; 128 bits is plenty to detect changed blocks
+    return hashlib.blake2b(digest_size=16)
+
+
+class BlockHasher:
+    """
+    Incremental block hashes, fed with the chunks of a download as they
+    arrive so the manifest costs no second read of the file.
+    """
+
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.size = 0
+        self.blocks = []
+        self._whole = hashlib.sha256()
+        self._block = _block_hash()
+        self._filled = 0
+
+    def update(self, data):
+        self._whole.update(data)
+        self.size += len(data)
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.block_size - self._filled)
+            self._block.update(view[:take])
+            self._filled += take
+            view = view[take:]
+            if self._filled == self.block_size:
+                self.blocks.append(self._block.hexdigest())
+                self._block = _block_hash()
+                self._filled = 0
+
+    def manifest(self, path):
+        """Manifest of `path`, which must hold exactly the bytes fed to this hasher."""
+        blocks = list(self.blocks)
+        if self._filled:
+            blocks.append(self._block.hexdigest())
+        stat = os.stat(path)
+        return {
+            "version": MANIFEST_VERSION,
+            "block_size": self.block_size,
+            "size": self.size,
+            "mtime_ns": stat.st_mtime_ns,  # With size, tells whether the manifest is still current
+            "sha256": self._whole.hexdigest(),
+            "blocks": blocks,
+        }
+
+
+def manifest_path(path):
+    return path + MANIFEST_SUFFIX
+
+
+def is_manifest(path):
+    return path.endswith(MANIFEST_SUFFIX)
+
+
+def resume_hasher(part_path, block_size=BLOCK_SIZE):
+    """Hasher primed with the bytes already in a `.part` file, for resumed downloads."""
+    hasher = BlockHasher(block_size)
+    with open(part_path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def hash_file(path, block_size=BLOCK_SIZE):
+    """Hashes an existing file through a memory map (no copies through Python read buffers)."""
+    hasher = BlockHasher(block_size)
+    if os.path.getsize(path):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            with memoryview(m) as view:
+                for start in range(0, len(view), block_size):
+                    hasher.update(view[start:start + block_size])
+    return hasher.manifest(path)
+
+
+def write_manifest(path, hasher=None):
+    """
+    Writes the sidecar manifest of a finished file, from the hasher that saw
+    its bytes or, without one, by hashing the file. Returns the manifest.
+    """
+    manifest = hasher.manifest(path) if hasher is not None else hash_file(path)
+    save_manifest(path, manifest)
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # Per-process temp name: workers on other nodes may save the same manifest
+    tmp_path = f"{manifest_path(path)}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path(path))
+
+
+def load_manifest(path):
+    """
+    The manifest of `path` if it exists and still describes the file (same
+    size and modification time), otherwise None.
+    """
+    try:
+        with open(manifest_path(path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if manifest.get("size") != stat.st_size or manifest.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return manifest
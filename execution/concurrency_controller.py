@@ -0,0 +1,199 @@
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from execution.driver_utils import is_login_page
+    from execution.retry_policy import HTTP_5XX, SESSION_EXPIRED, THROTTLED, TIMEOUT
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from driver_utils import is_login_page
+    from retry_policy import HTTP_5XX, SESSION_EXPIRED, THROTTLED, TIMEOUT
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+METRICS_FILE = os.path.join(OUTPUT_ROOT, "concurrency_metrics.jsonl")
+
+# Error classes (see retry_policy) that mean "back off", not "this item is broken"
+BACKOFF_SIGNALS = {THROTTLED, HTTP_5XX, SESSION_EXPIRED, TIMEOUT}
+
+ADDITIVE_INCREASE = 1  # Slots added after a healthy round
+THROTTLE_DECREASE = 0.5  # Limit multiplier on 429/5xx/login redirect/timeout
+LATENCY_DECREASE = 0.75  # Limit multiplier when latency climbs
+LATENCY_FACTOR = 2.0  # "Climbing" = round median latency above this multiple of the best seen
+RATE_TOLERANCE = 0.2  # Per-worker rate may fall this much below the best before growth stops
+ACQUIRE_POLL = 0.05  # Seconds between slot checks of async waiters
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit for one
+    stage (e.g. PDF transfers or PDF resolution).
+
+    Callers take a slot with acquire() / acquire_async(), give it back with
+    release() and report every request with record(). Outcomes are evaluated
+    in rounds of `limit` records: the limit grows by one while the stage used
+    all its slots and the rate per worker held up, shrinks by LATENCY_DECREASE
+    when latency climbs, and is cut by THROTTLE_DECREASE right away on a
+    back-off signal (at most once per round). Every decision is kept in
+    `decisions` and appended to `metrics_file` if given.
+    """
+
+    def __init__(self, name, initial=4, minimum=1, maximum=64, metrics_file=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.metrics_file = metrics_file
+        self.in_flight = 0
+        self.decisions = []
+        self._cond = threading.Condition()
+        self._round = []  # (seconds, rate) of successful requests
+        self._round_peak = 0
+        self._since_cut = maximum  # The first back-off signal always cuts
+        self._best_latency = None
+        self._best_rate = None
+        self._signals = 0
+
+    # Slots
+
+    def _has_slot(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire(self):
+        with self._cond:
+            while not self._has_slot():
+                self._cond.wait()
+            self._take()
+
+    async def acquire_async(self):
+        while True:
+            with self._cond:
+                if self._has_slot():
+                    self._take()
+                    return
+            await asyncio.sleep(ACQUIRE_POLL)
+
+    def _take(self):
+        self.in_flight += 1
+        self._round_peak = max(self._round_peak, self.in_flight)
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def map(self, fn, items):
+        """Like ThreadPoolExecutor.map, with at most `limit` calls running at once."""
+        def run(item):
+            self.acquire()
+            try:
+                return fn(item)
+            finally:
+                self.release()
+
+        with ThreadPoolExecutor(max_workers=self.maximum) as pool:
+            return list(pool.map(run, items))
+
+    def watch_session(self, session):
+        """Feeds every response of a requests session into record()."""
+        if self.record_response not in session.hooks["response"]:
+            session.hooks["response"].append(self.record_response)
+        return session
+
+    # Feedback
+
+    def record(self, seconds, nbytes=0, signal=None):
+        """
+        Reports one finished request: its duration, the bytes it moved (0 for
+        lookups) and the error class if it failed.
+        """
+        with self._cond:
+            self._since_cut += 1
+            if signal in BACKOFF_SIGNALS:
+                self._signals += 1
+                # One cut per round: the other in-flight requests were sent
+                # at the old limit and will likely fail too.
+                if self._since_cut >= int(self.limit):
+                    self._set_limit(self.limit * THROTTLE_DECREASE, "decrease", signal)
+                return
+            if signal is not None or seconds <= 0:
+                return
+
+            rate = nbytes / seconds if nbytes else 1 / seconds
+            self._round.append((seconds, rate))
+            if len(self._round) >= int(self.limit):
+                self._end_round()
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        requests response hook. Only the time to the response headers is
+        known here, so responses count as lookups (latency only).
+        """
+        signal = None
+        if response.status_code == 429:
+            signal = THROTTLED
+        elif response.status_code >= 500:
+            signal = HTTP_5XX
+        elif response.status_code in (401, 403) or is_login_page(response.url):
+            signal = SESSION_EXPIRED
+        self.record(response.elapsed.total_seconds(), signal=signal)
+
+    def _end_round(self):
+        latency = statistics.median(seconds for seconds, _ in self._round)
+        rate = statistics.median(r for _, r in self._round)
+        saturated = self._round_peak >= int(self.limit)
+        self._round, self._round_peak = [], self.in_flight
+
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        if self._best_rate is None or rate > self._best_rate:
+            self._best_rate = rate
+
+        if latency > self._best_latency * LATENCY_FACTOR:
+            self._set_limit(self.limit * LATENCY_DECREASE, "decrease", f"latency {latency:.2f}s", latency, rate)
+        elif saturated and rate >= self._best_rate * (1 - RATE_TOLERANCE):
+            self._set_limit(self.limit + ADDITIVE_INCREASE, "increase", "rate held", latency, rate)
+        else:
+            self._log("hold", "not saturated" if not saturated else "rate per worker fell", latency, rate)
+
+    def _set_limit(self, limit, event, reason, latency=None, rate=None):
+        self.limit = float(max(self.minimum, min(self.maximum, limit)))
+        if event == "decrease":
+            self._since_cut = 0
+            self._round, self._round_peak = [], self.in_flight
+        self._cond.notify_all()
+        self._log(event, reason, latency, rate)
+
+    def _log(self, event, reason, latency=None, rate=None):
+        decision = {
+            "time": round(time.time(), 3),
+            "controller": self.name,
+            "event": event,
+            "reason": reason,
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "median_latency": round(latency, 3) if latency is not None else None,
+            "median_rate": round(rate, 1) if rate is not None else None,
+        }
+        self.decisions.append(decision)
+        if event != "hold":
+            print(f"  [AIMD {self.name}] {event} to {int(self.limit)} ({reason})")
+        if self.metrics_file:
+            with open(self.metrics_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(decision) + "\n")
+
+    def print_summary(self):
+        counts = {}
+        for decision in self.decisions:
+            counts[decision["event"]] = counts.get(decision["event"], 0) + 1
+        limits = [decision["limit"] for decision in self.decisions] or [int(self.limit)]
+        print(
+            f"[AIMD {self.name}] final limit {int(self.limit)} (range {min(limits)}-{max(limits)}), "
+            f"{counts.get('increase', 0)} increases, {counts.get('decrease', 0)} decreases, "
+            f"{self._signals} back-off signals"
+        )
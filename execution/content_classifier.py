@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    from execution.driver_utils import is_login_page
+    from execution.kaltura_video_extractor import DISPOSITION_FILENAME_PATTERN, direct_file_url
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from driver_utils import is_login_page
+    from kaltura_video_extractor import DISPOSITION_FILENAME_PATTERN, direct_file_url
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+CLASSIFIER_CACHE_FILE = os.path.join(OUTPUT_ROOT, "classifier_cache.json")
+
+LOOKUP_WORKERS = 16  # Concurrent HEAD lookups for ambiguous links
+
+# Tags
+VIDEO = "[VIDEO]"
+PDF = "[PDF]"
+SLIDES = "[SLIDES]"  # PowerPoint decks: reported, not queued
+QUIZ = "[QUIZ]"
+OTHER = "[OTHER]"
+
+# (pattern, where to look, tag, confident). The first match wins. Links whose
+# first match is not confident get a HEAD lookup of the topic's file.
+# "title" is the link's title attribute, where Brightspace names the topic
+# type (e.g. "... - PDF document", "... - External Learning Tool").
+CLASSIFICATION_RULES = [
+    (re.compile(r"external learning tool", re.IGNORECASE), "title", VIDEO, True),
+    (re.compile(r"\(\d+:\d{2}(?::\d{2})?\)"), "text", VIDEO, True),
+    (re.compile(r"\.pptx?\b|powerpoint", re.IGNORECASE), "both", SLIDES, True),
+    (re.compile(r"pdf", re.IGNORECASE), "both", PDF, True),
+    (re.compile(r"\.docx?\b|word document", re.IGNORECASE), "both", OTHER, True),
+    (re.compile(r"quiz", re.IGNORECASE), "text", QUIZ, True),
+    (re.compile(r"slides", re.IGNORECASE), "both", PDF, False),
+    (re.compile(r"\b(video|lecture|recording|kaltura|mediaspace)\b", re.IGNORECASE), "both", VIDEO, False),
+]
+
+MIME_TAGS = {
+    "application/pdf": PDF,
+    "application/vnd.ms-powerpoint": SLIDES,
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": SLIDES,
+}
+EXTENSION_TAGS = {".pdf": PDF, ".ppt": SLIDES, ".pptx": SLIDES}
+
+# Without a file behind it, a "video"-looking link is only a video if it
+# points at an external tool or the Kaltura player.
+VIDEO_LINK_PATTERN = re.compile(r"/lti/|kaltura|mediaspace|external learning tool", re.IGNORECASE)
+
+# lookup_file_type answer for topics that are definitely not a file
+NOT_A_FILE = "not_a_file"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def link_text(text, title_attr):
+    """Link text, falling back to the title attribute without the tool suffix."""
+    if not text and title_attr:
+        # Remove " - External Learning Tool" suffix if present
+        return title_attr.replace(" - External Learning Tool", "").replace("'", "").strip()
+    return text
+
+
+def classify_text(text, title_attr):
+    """Classifies a link by its text and title attribute. Returns (tag, confident)."""
+    title_attr = title_attr or ""
+    for pattern, field, tag, confident in CLASSIFICATION_RULES:
+        haystacks = {"text": (text,), "title": (title_attr,), "both": (text, title_attr)}[field]
+        if any(pattern.search(h) for h in haystacks if h):
+            return tag, confident
+    return OTHER, False
+
+
+def load_cache(path=CLASSIFIER_CACHE_FILE):
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = {}
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    _cache = json.load(f)
+        return _cache
+
+
+def save_cache(path=CLASSIFIER_CACHE_FILE):
+    with _cache_lock:
+        if _cache is None:
+            return
+        tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_cache, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def lookup_file_type(session, href):
+    """
+    HEAD request for the file behind a content topic. Returns (mime type,
+    file extension) for a file, NOT_A_FILE if the topic definitely is not
+    one (links, external tools, viewer pages), or None if the lookup failed
+    (error status, login redirect, network error) and may be retried.
+    """
+    file_url = direct_file_url(href)
+    if not file_url:
+        return NOT_A_FILE
+    try:
+        r = session.head(file_url, allow_redirects=True, timeout=20)
+        if r.status_code == 405:  # No HEAD support; a one-byte GET has the same headers
+            r = session.get(file_url, headers={"Range": "bytes=0-0"}, stream=True, timeout=20)
+            r.close()
+        if not r.ok or is_login_page(r.url):
+            return None
+    except requests.RequestException:
+        return None
+
+    mime = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    match = DISPOSITION_FILENAME_PATTERN.search(r.headers.get("Content-Disposition", ""))
+    ext = os.path.splitext(match.group(1))[1].lower() if match else ""
+    if mime == "text/html" and not ext:
+        return NOT_A_FILE  # A viewer page, not the file
+    return mime, ext
+
+
+def tag_from_lookup(guess, found, href="", text="", title_attr=""):
+    """Final tag of an ambiguous link from its rule guess and a definite lookup result."""
+    if found == NOT_A_FILE:
+        # Only external tools and Kaltura pages are videos without a file;
+        # anything else (e.g. "slides" that are a web link) cannot be
+        # downloaded as a PDF either.
+        if guess == VIDEO and VIDEO_LINK_PATTERN.search(f"{href} {text or ''} {title_attr or ''}"):
+            return VIDEO
+        return OTHER
+    mime, ext = found
+    return MIME_TAGS.get(mime) or EXTENSION_TAGS.get(ext) or OTHER
+
+
+def classify_links(session, links, workers=LOOKUP_WORKERS):
+    """
+    Classifies (href, text, title_attr) links in one batch. Confident rule
+    matches are used as is; the others are looked up concurrently unless an
+    earlier run already did. Returns {href: tag}.
+    """
+    cache = load_cache()
+    tags = {}
+    labels = {}
+    ambiguous = []
+    for href, text, title_attr in links:
+        if not href or href in tags:
+            continue
+        tag, confident = classify_text(link_text(text, title_attr), title_attr)
+        with _cache_lock:
+            cached = cache.get(href)
+        if confident:
+            tags[href] = tag
+        elif cached:
+            tags[href] = cached["tag"]
+        else:
+            tags[href] = tag
+            labels[href] = (text, title_attr)
+            ambiguous.append(href)
+
+    if ambiguous and session is not None:
+        started = time.time()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for href, found in zip(ambiguous, pool.map(lambda h: lookup_file_type(session, h), ambiguous)):
+                if found is None:
+                    # Keep the rule's guess for now; the next scan asks again
+                    failed += 1
+                    continue
+                tags[href] = tag_from_lookup(tags[href], found, href, *labels[href])
+                with _cache_lock:
+                    cache[href] = {
+                        "tag": tags[href],
+                        "mime": None if found == NOT_A_FILE else found[0],
+                        "checked": time.time(),
+                    }
+        print(f"  Looked up {len(ambiguous)} ambiguous links in {time.time() - started:.1f}s"
+              + (f" ({failed} failed, not cached)." if failed else "."))
+    return tags
@@ -1,63 +1,139 @@
+import json
 import os
 import sys
+import threading
 import time
 
 import undetected_chromedriver as uc
-from dotenv import load_dotenv
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
+from selenium import webdriver as plain_webdriver
 from seleniumwire import webdriver
 
+try:
+    from execution.tenant_config import ENV_FILE, NONINTERACTIVE_ENV, get_tenant
+    from execution.webdriver_profiler import attach_profiler, profiling_enabled
+except ImportError:
+    from tenant_config import ENV_FILE, NONINTERACTIVE_ENV, get_tenant
+    from webdriver_profiler import attach_profiler, profiling_enabled
+
 # User-Agent
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/139.0.0.0 Safari/537.36"
 
-def setup_driver(headless=False):
-    """Sets up and returns a Selenium Wire driver with undetected-chromedriver options."""
+# Network capture backends, selected with CAPTURE_BACKEND in the environment:
+#   "wire": selenium-wire MITM proxy (every byte passes through Python)
+#   "cdp":  Chrome's own performance log (DevTools Network events), no proxy
+CAPTURE_WIRE = "wire"
+CAPTURE_CDP = "cdp"
+DEFAULT_CAPTURE_BACKEND = CAPTURE_WIRE
+
+def setup_driver(headless=False, capture=None):
+    """
+    Sets up and returns a Chrome driver with undetected-chromedriver options.
+    `capture` selects how page network traffic is observed (see CAPTURE_*);
+    it defaults to the CAPTURE_BACKEND environment variable.
+    """
+    capture = (capture or os.getenv("CAPTURE_BACKEND") or DEFAULT_CAPTURE_BACKEND).lower()
     chrome_options = uc.ChromeOptions()
     chrome_options.add_argument(f"--user-agent={USER_AGENT}")
     if headless:
          chrome_options.add_argument("--headless")
     
-    # Use seleniumwire's webdriver.Chrome, but with undetected_chromedriver's options
-    driver = webdriver.Chrome(options=chrome_options)
+    if capture == CAPTURE_CDP:
+        # Chrome records DevTools Network events into the performance log;
+        # traffic goes straight to the network without a proxy in between.
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        # Keep cross-origin iframes (the Kaltura player) in the page's process so
+        # their network events show up in the same log.
+        chrome_options.add_argument("--disable-features=IsolateOrigins,site-per-process")
+        driver = plain_webdriver.Chrome(options=chrome_options)
+    else:
+        # Use seleniumwire's webdriver.Chrome, but with undetected_chromedriver's options
+        driver = webdriver.Chrome(options=chrome_options)
+    driver.capture_backend = capture
+    if profiling_enabled():
+        attach_profiler(driver)
     driver.set_window_size(1728, 1080)
     return driver
 
+def begin_capture(driver):
+    """
+    Marks the start of the traffic to search with find_request_url. Call it
+    right before navigating. Returns a marker to pass to find_request_url.
+    """
+    if getattr(driver, "capture_backend", CAPTURE_WIRE) == CAPTURE_CDP:
+        driver.get_log("performance")  # Reading the log drains it
+        return None
+    return len(driver.requests)
+
+def _cdp_response_urls(driver):
+    """URLs of responses received since the performance log was last read."""
+    urls = []
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message.get("method") == "Network.responseReceived":
+            urls.append(message["params"]["response"]["url"])
+    return urls
+
+def find_request_url(driver, marker, pattern, timeout=20, poll=0.5):
+    """
+    Returns the first URL containing `pattern` that got a response since
+    begin_capture, waiting up to `timeout` seconds; None if none appeared.
+    Works the same for both capture backends.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if getattr(driver, "capture_backend", CAPTURE_WIRE) == CAPTURE_CDP:
+            for url in _cdp_response_urls(driver):
+                if pattern in url:
+                    return url
+        else:
+            for request in driver.requests[marker:]:
+                if request.response and pattern in request.url:
+                    return request.url
+        if time.time() >= deadline:
+            return None
+        time.sleep(poll)
+
+def get_brightspace_cookies():
+    """Returns the tenant's Brightspace cookies (Selenium cookie dicts) from the env file."""
+    tenant = get_tenant()
+    domain = tenant["cookie_domain"]
+    cookies = [{"name": name, "value": "1", "domain": domain} for name in tenant["canary_cookies"]]
+    for name, env_var in tenant["session_cookies"].items():
+        cookies.append({"name": name, "value": os.getenv(env_var), "domain": domain})
+    return cookies
+
 def load_brightspace_cookies(driver):
-    """Loads Brightspace cookies from .env/.env and adds them to the driver."""
-    dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env', '.env')
-    load_dotenv(dotenv_path=dotenv_path, override=True)
-
-    cookies = [
-        {"name": "d2lSameSiteCanaryA", "value": "1", "domain": ".purdue.brightspace.com"},
-        {"name": "d2lSameSiteCanaryB", "value": "1", "domain": ".purdue.brightspace.com"},
-        {"name": "d2lSecureSessionVal", "value": os.getenv("D2L_SECURE_SESSION_VAL"), "domain": ".purdue.brightspace.com"},
-        {"name": "d2lSessionVal", "value": os.getenv("D2L_SESSION_VAL"), "domain": ".purdue.brightspace.com"},
-    ]
+    """Loads Brightspace cookies from the env file (.env/.env by default) and adds them to the driver."""
+    tenant = get_tenant()
+    cookies = get_brightspace_cookies()
     
     # Check if critical cookies are present
     # We used to exit here, but now we want to fallback to auto-login.
     # So we just warn and proceed. validate_and_refresh_session will handle the login page redirect.
-    if not all(c["value"] for c in cookies if c["name"] in ["d2lSecureSessionVal", "d2lSessionVal"]):
+    if not all(c["value"] for c in cookies if c["name"] in tenant["session_cookies"]):
         print("Warning: Missing cookies in .env. Will attempt auto-login shortly.")
     else:
         print("Cookies loaded from .env.")
 
-    driver.get("https://purdue.brightspace.com")  # Must be on domain before adding cookies
+    driver.get(tenant["base_url"])  # Must be on domain before adding cookies
     for cookie in cookies:
         if cookie["value"]: # Only add if value exists
              driver.add_cookie(cookie)
     
     # Reload the page to apply cookies and clear any login redirects
-    driver.get("https://purdue.brightspace.com")
+    driver.get(tenant["base_url"])
 
 
 
 
 def save_cookies_to_env(cookies_dict):
-    """Updates the .env/.env file with new cookie values."""
-    dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env', '.env')
+    """Updates the env file (.env/.env by default) with new cookie values."""
+    dotenv_path = ENV_FILE
+    env_vars = {env_var: name for name, env_var in get_tenant()["session_cookies"].items()}
     
     # Read existing content
     with open(dotenv_path, 'r', encoding='utf-8') as f:
@@ -65,10 +141,9 @@ def save_cookies_to_env(cookies_dict):
         
     new_lines = []
     for line in lines:
-        if line.startswith("D2L_SECURE_SESSION_VAL="):
-            new_lines.append(f"D2L_SECURE_SESSION_VAL={cookies_dict.get('d2lSecureSessionVal', '')}\n")
-        elif line.startswith("D2L_SESSION_VAL="):
-            new_lines.append(f"D2L_SESSION_VAL={cookies_dict.get('d2lSessionVal', '')}\n")
+        env_var = line.split("=", 1)[0].strip()
+        if env_var in env_vars:
+            new_lines.append(f"{env_var}={cookies_dict.get(env_vars[env_var], '')}\n")
         else:
             new_lines.append(line)
             
@@ -100,36 +175,116 @@ def find_element_shadow(driver, selector):
     """
     return driver.execute_script(script, selector)
 
+# Resolves once no DOM mutation happened under the root element for quiet_ms,
+# or after timeout_ms at the latest. Returns the settle time in ms, or -1 on timeout.
+DOM_SETTLE_SCRIPT = """
+const [selector, quietMs, timeoutMs, done] = arguments;
+const root = (selector && document.querySelector(selector)) || document.body;
+const start = performance.now();
+let quietTimer = null;
+let hardTimer = null;
+const observer = new MutationObserver(() => {
+    clearTimeout(quietTimer);
+    quietTimer = setTimeout(finish, quietMs);
+});
+function finish(timedOut) {
+    observer.disconnect();
+    clearTimeout(quietTimer);
+    clearTimeout(hardTimer);
+    done(timedOut === true ? -1 : performance.now() - start);
+}
+observer.observe(root, {childList: true, subtree: true, attributes: true, characterData: true});
+quietTimer = setTimeout(finish, quietMs);
+hardTimer = setTimeout(() => finish(true), timeoutMs);
+"""
+
+def record_wait(timings, step, seconds):
+    """Adds a measured wait to `timings` ({step: [total_seconds, count]})."""
+    if timings is not None:
+        entry = timings.setdefault(step, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+def wait_for(driver, condition, timeout, step, timings=None, poll=0.1):
+    """
+    Waits until condition(driver) returns something truthy and returns it, or
+    None after `timeout` seconds. The time actually waited is recorded under
+    `step` so slow steps show up in the scan summary.
+    """
+    start = time.time()
+    try:
+        result = WebDriverWait(driver, timeout, poll_frequency=poll).until(condition)
+    except TimeoutException:
+        print(f"  [WAIT] {step}: not ready after {timeout}s")
+        result = None
+    record_wait(timings, step, time.time() - start)
+    return result
+
+def wait_for_dom_settle(driver, step, timings=None, root_selector=None, quiet_ms=300, timeout=10):
+    """
+    Waits until the DOM under `root_selector` (default: body) has stopped
+    changing for `quiet_ms`, using a MutationObserver in the page instead of a
+    fixed sleep. Returns True if it settled before `timeout` seconds.
+    """
+    start = time.time()
+    # Other async scripts on this driver keep their own timeout
+    previous_timeout = driver.timeouts.script
+    driver.set_script_timeout(timeout + 5)
+    try:
+        settled_ms = driver.execute_async_script(DOM_SETTLE_SCRIPT, root_selector, quiet_ms, int(timeout * 1000))
+    except Exception as e:
+        print(f"  [WAIT] {step}: settle check failed: {e}")
+        settled_ms = -1
+    finally:
+        driver.set_script_timeout(previous_timeout)
+    record_wait(timings, step, time.time() - start)
+    if settled_ms < 0:
+        print(f"  [WAIT] {step}: DOM still changing after {timeout}s")
+    return settled_ms >= 0
+
+def document_ready(driver):
+    return driver.execute_script("return document.readyState") == "complete"
+
+def print_wait_summary(timings, label):
+    """Prints the waited time per step, slowest first."""
+    if not timings:
+        return
+    total = sum(seconds for seconds, _ in timings.values())
+    print(f"  [WAIT] {label}: {total:.1f}s waiting in total")
+    for step, (seconds, count) in sorted(timings.items(), key=lambda kv: -kv[1][0]):
+        print(f"    {step:<24} {seconds:6.1f}s over {count} waits (avg {seconds / count:.2f}s)")
+
 def perform_purl_login(driver):
-    """Performs the login sequence via Purdue authentication."""
+    """
+    Performs the login sequence via the tenant's identity provider (Purdue
+    authentication by default; see D2L_IDP_LINK_SELECTORS and friends).
+    """
     print("Attempting Auto-Login...")
     print(f"Current URL before login attempt: {driver.current_url}")
+    tenant = get_tenant()
+    selectors = tenant["idp_link_selectors"]
     
     try:
-        # 1. Click "Purdue West Lafayette / Indianapolis"
+        # 1. Click the IdP link (Purdue: "Purdue West Lafayette / Indianapolis")
         login_link = None
         
         # Try standard find first
-        try:
-             login_link = WebDriverWait(driver, 5).until(
-                 EC.element_to_be_clickable((By.CSS_SELECTOR, "a[title*='Purdue West Lafayette']"))
-             )
-        except:
-             pass
+        if selectors:
+            try:
+                 login_link = WebDriverWait(driver, 5).until(
+                     EC.element_to_be_clickable((By.CSS_SELECTOR, selectors[0]))
+                 )
+            except:
+                 pass
              
-        # Try Shadow DOM find if standard failed
-        if not login_link:
-            print("Standard search failed. Trying Shadow DOM search for 'Purdue West Lafayette'...")
-            login_link = find_element_shadow(driver, "a[title*='Purdue West Lafayette']")
-            
-        # Fallback to generic IDP if specific title fails
-        if not login_link:
-             print("Specific title not found. Trying generic IDP link in Shadow DOM...")
-             # Note: This might pick up Fort Wayne or Northwest if they share the IDP, but usually specific is better.
-             # Purdue West Lafayette usually has 'idp.purdue.edu' while others might have different ones?
-             # User snippet shows others have different entityIds (e.g. pfw, purdueglobal).
-             # West Lafayette is 'https://idp.purdue.edu/idp/shibboleth'
-             login_link = find_element_shadow(driver, "a[href*='idp.purdue.edu']")
+        # Try Shadow DOM find if standard failed, then the more generic fallbacks.
+        # (Purdue: the specific title first, then the generic 'idp.purdue.edu' link,
+        # which might also match Fort Wayne or Northwest if they share the IdP.)
+        for selector in selectors:
+            if login_link:
+                break
+            print(f"Trying Shadow DOM search for IdP link '{selector}'...")
+            login_link = find_element_shadow(driver, selector)
 
         if login_link:
              print("Found Login Link. Clicking...")
@@ -143,7 +298,7 @@ def perform_purl_login(driver):
         
         # Wait for username field
         WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.ID, "username"))
+            EC.presence_of_element_located((By.ID, tenant["username_field_id"]))
         )
          
         username = os.getenv("D2L_USERNAME")
@@ -154,10 +309,10 @@ def perform_purl_login(driver):
             return False
 
         print("Entering credentials...")
-        driver.find_element(By.ID, "username").send_keys(username)
-        driver.find_element(By.ID, "password").send_keys(password)
+        driver.find_element(By.ID, tenant["username_field_id"]).send_keys(username)
+        driver.find_element(By.ID, tenant["password_field_id"]).send_keys(password)
         
-        submit_btn = driver.find_element(By.NAME, "_eventId_proceed")
+        submit_btn = driver.find_element(By.NAME, tenant["submit_button_name"])
         submit_btn.click()
         print("Submitted credentials.")
         
@@ -166,7 +321,7 @@ def perform_purl_login(driver):
         
         # Wait for redirect back to brightspace
         WebDriverWait(driver, 120).until( # Increased wait time for 2FA
-            EC.url_contains("purdue.brightspace.com/d2l/home")
+            EC.url_contains(f"{tenant['host']}/d2l/home")
         )
         print("Login successful! Session established.")
         return True
@@ -179,15 +334,43 @@ def perform_purl_login(driver):
         except: pass
         return False
 
+def is_login_page(url):
+    """True if the URL looks like a login/auth redirect, i.e. the session has expired."""
+    url = (url or "").lower()
+    return "login" in url or "auth" in url
+
+class LoginRequiredError(RuntimeError):
+    """Auto-login failed and nobody can log in by hand (D2L_NONINTERACTIVE)."""
+
+# Only one thread logs in at a time; threads that waited reuse the cookies
+# the login saved instead of logging in again.
+_session_lock = threading.Lock()
+_session_refreshes = 0
+
 def validate_and_refresh_session(driver):
     """
     Checks if session is valid. If not, restarts driver in NON-HEADLESS mode,
-    performs login, updates cookies, and returns the new driver.
+    performs login, updates cookies, and returns the new driver. Safe to call
+    from several threads (watch mode workers).
     """
+    global _session_refreshes
+    if not is_login_page(driver.current_url):
+        return driver
+    seen = _session_refreshes
+    with _session_lock:
+        if _session_refreshes != seen:
+            print("Session was refreshed by another worker. Reloading cookies...")
+            load_brightspace_cookies(driver)
+            if not is_login_page(driver.current_url):
+                return driver
+        driver = _refresh_expired_session(driver)
+        _session_refreshes += 1
+    return driver
+
+def _refresh_expired_session(driver):
     # Check if we are on a login page or home page
     # If we just loaded cookies and refreshed, we should be on /d2l/home
-    current_url = driver.current_url
-    if "login" in current_url.lower() or "auth" in current_url.lower():
+    if is_login_page(driver.current_url):
         print("Session appears expired (Redirected to Login).")
         
         # We need to switch to Headless=False to allow potential interactivity (2FA)
@@ -195,14 +378,15 @@ def validate_and_refresh_session(driver):
         print("Relaunching driver in NON-HEADLESS mode for authentication...")
         driver.quit()
         
+        tenant = get_tenant()
         driver = setup_driver(headless=False)
-        driver.get("https://purdue.brightspace.com")
+        driver.get(tenant["base_url"])
         
         if perform_purl_login(driver):
             # Capture new cookies
             new_cookies = {}
             for c in driver.get_cookies():
-                if c['name'] in ['d2lSecureSessionVal', 'd2lSessionVal']:
+                if c['name'] in tenant["session_cookies"]:
                     new_cookies[c['name']] = c['value']
             
             if new_cookies:
@@ -214,18 +398,24 @@ def validate_and_refresh_session(driver):
                 driver = setup_driver(headless=True)
                 load_brightspace_cookies(driver) # Reloads the fresh cookies from .env
                 print("Reloading Homepage with new session...")
-                driver.get("https://purdue.brightspace.com") # Apply cookies by navigating
+                driver.get(tenant["base_url"]) # Apply cookies by navigating
             
             else:
                 print("Warning: Could not capture new cookies after login.")
         else:
+            if os.getenv(NONINTERACTIVE_ENV):
+                driver.quit()
+                raise LoginRequiredError(
+                    "Auto-login failed and no manual login is possible (D2L_NONINTERACTIVE). "
+                    "Run the parser once by hand for this account to refresh its cookies."
+                )
             print("Auto-login failed. Please login manually in the window.")
             # We could pause here?
             input("Press Enter after you have manually logged in and are on the Brightspace homepage >> ")
             # Capture anyway
             new_cookies = {}
             for c in driver.get_cookies():
-                if c['name'] in ['d2lSecureSessionVal', 'd2lSessionVal']:
+                if c['name'] in tenant["session_cookies"]:
                     new_cookies[c['name']] = c['value']
             save_cookies_to_env(new_cookies)
             
@@ -0,0 +1,167 @@
+import argparse
+import os
+import struct
+
+try:
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from tenant_config import OUTPUT_ROOT
+
+# Results of check_file
+COMPLETE = "complete"
+MISSING = "missing"
+TRUNCATED = "truncated"
+CORRUPT = "corrupt"
+
+PART_SUFFIX = ".part"
+
+# Only this much of the end of a PDF is read to look for the trailer.
+PDF_TAIL_BYTES = 2048
+
+
+def iter_mp4_boxes(f, file_size, start=0):
+    """
+    Yields (type, offset, size) for the top-level boxes of an MP4 file, or for
+    the children of a box whose body spans `start` to `file_size`.
+    Only the 8/16 byte box headers are read; box bodies are skipped with seek,
+    so this is a handful of small reads regardless of file size.
+    """
+    offset = start
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError(f"truncated box header at {offset}")
+        size, box_type = struct.unpack(">I4s", header)
+        if size == 1:
+            large = f.read(8)
+            if len(large) < 8:
+                raise ValueError(f"truncated 64-bit box size at {offset}")
+            size = struct.unpack(">Q", large)[0]
+        elif size == 0:
+            size = file_size - offset  # Box extends to end of file
+        if size < 8:
+            raise ValueError(f"invalid box size {size} at {offset}")
+        yield box_type.decode("latin-1"), offset, size
+        offset += size
+    if offset != file_size:
+        raise ValueError(f"last box ends at {offset}, file is {file_size} bytes")
+
+
+def verify_mp4(path):
+    """Returns None if the MP4 box structure is intact, otherwise a reason string."""
+    file_size = os.path.getsize(path)
+    seen = []
+    try:
+        with open(path, "rb") as f:
+            for box_type, _, _ in iter_mp4_boxes(f, file_size):
+                seen.append(box_type)
+    except ValueError as e:
+        return str(e)
+    if not seen or seen[0] != "ftyp":
+        return "missing ftyp box"
+    if "moov" not in seen:
+        return "missing moov box"
+    return None
+
+
+def mp4_duration(path):
+    """Duration in seconds from the movie header (moov/mvhd), or None. Reads only box headers."""
+    try:
+        with open(path, "rb") as f:
+            file_size = os.fstat(f.fileno()).st_size
+            for box_type, offset, size in iter_mp4_boxes(f, file_size):
+                if box_type != "moov":
+                    continue
+                f.seek(offset)
+                body = offset + (16 if struct.unpack(">I", f.read(4))[0] == 1 else 8)
+                for child_type, child_offset, _ in iter_mp4_boxes(f, offset + size, body):
+                    if child_type != "mvhd":
+                        continue
+                    f.seek(child_offset + 8)
+                    version = f.read(4)[0]
+                    if version == 1:
+                        f.seek(16, os.SEEK_CUR)  # 64-bit creation/modification times
+                        timescale, duration = struct.unpack(">IQ", f.read(12))
+                    else:
+                        f.seek(8, os.SEEK_CUR)
+                        timescale, duration = struct.unpack(">II", f.read(8))
+                    return duration / timescale if timescale else None
+    except (OSError, ValueError, IndexError, struct.error):
+        pass
+    return None
+
+
+def verify_pdf(path):
+    """Returns None if the PDF header and trailer are present, otherwise a reason string."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            return "missing %PDF- header"
+        f.seek(max(0, file_size - PDF_TAIL_BYTES))
+        if b"%%EOF" not in f.read():
+            return "missing %%EOF trailer"
+    return None
+
+
+VERIFIERS = {
+    ".mp4": verify_mp4,
+    ".pdf": verify_pdf,
+}
+
+
+def check_file(path, expected_size=None, ext=None):
+    """
+    Checks whether a downloaded file exists and is complete without reading
+    the whole file. `expected_size` is the remote Content-Length or the size
+    recorded by an earlier run, if known. `ext` overrides the extension used to
+    pick the structure check (e.g. for `.part` files).
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return MISSING
+    if size == 0:
+        return TRUNCATED
+    if expected_size is not None and size != expected_size:
+        return TRUNCATED if size < expected_size else CORRUPT
+
+    verifier = VERIFIERS.get((ext or os.path.splitext(path)[1]).lower())
+    if verifier:
+        reason = verifier(path)
+        if reason:
+            print(f"  [VERIFY] {os.path.basename(path)}: {reason}")
+            return CORRUPT
+    return COMPLETE
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check downloaded files for truncation or corruption.")
+    parser.add_argument("path", nargs="?", default=os.path.join(OUTPUT_ROOT, "downloads"), help="Directory to scan (default: downloads/).")
+    parser.add_argument("--delete", action="store_true", help="Delete broken files so the next batch run downloads them again.")
+    args = parser.parse_args()
+
+    checked = 0
+    broken = []
+    for root, _, files in os.walk(args.path):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(PART_SUFFIX):
+                broken.append((path, "incomplete download"))
+                continue
+            if os.path.splitext(name)[1].lower() not in VERIFIERS:
+                continue
+            checked += 1
+            state = check_file(path)
+            if state != COMPLETE:
+                broken.append((path, state))
+
+    print(f"Checked {checked} files, {len(broken)} broken.")
+    for path, reason in broken:
+        print(f"  {reason}: {path}")
+        if args.delete and not path.endswith(PART_SUFFIX):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
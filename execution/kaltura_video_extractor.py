@@ -3,6 +3,7 @@ import os
 import re
 import string
 import sys
+import threading
 import time
 import urllib.parse
 
@@ -23,143 +24,350 @@ def sanitize_filename(name):
     valid_chars = f"-_.() {string.ascii_letters}{string.digits}"
     return ''.join(c if c in valid_chars else '_' for c in name).strip()
 
+# The first HLS segment request of the Kaltura player; its URL leads to the full video
+SEGMENT_URL_PATTERN = "-v1-a1.ts"
+SEGMENT_TIMEOUT = 20  # Seconds to wait for the player to start
+
+# viewContent URL of a content topic: /d2l/le/content/{orgUnitId}/viewContent/{topicId}/View
+VIEW_CONTENT_PATTERN = re.compile(r"^(https?://[^/]+)/d2l/le/content/(\d+)/viewContent/(\d+)")
+DISPOSITION_FILENAME_PATTERN = re.compile(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)\"?", re.IGNORECASE)
+
+# LE API version per tenant base URL, looked up once per process
+_le_versions = {}
+_le_versions_lock = threading.Lock()
+
 try:
-    from execution.driver_utils import load_brightspace_cookies, setup_driver
+    from execution.driver_utils import (
+        begin_capture,
+        find_request_url,
+        is_login_page,
+        load_brightspace_cookies,
+        setup_driver,
+    )
+    from execution.block_manifest import BlockHasher, load_manifest, resume_hasher, write_manifest
+    from execution.file_integrity import COMPLETE, MISSING, PART_SUFFIX, check_file
+    from execution.object_storage import S3, check_stored, object_url, storage_backend, stream_to_object
+    from execution.queue_lease import global_slot
+    from execution.tenant_config import get_tenant
 except ImportError:
-    from driver_utils import load_brightspace_cookies, setup_driver
+    from driver_utils import (
+        begin_capture,
+        find_request_url,
+        is_login_page,
+        load_brightspace_cookies,
+        setup_driver,
+    )
+    from block_manifest import BlockHasher, load_manifest, resume_hasher, write_manifest
+    from file_integrity import COMPLETE, MISSING, PART_SUFFIX, check_file
+    from object_storage import S3, check_stored, object_url, storage_backend, stream_to_object
+    from queue_lease import global_slot
+    from tenant_config import get_tenant
 
 
 def set_brightspace_cookies(driver):
     load_brightspace_cookies(driver)
     
 
+def make_session(driver=None):
+    """Creates a requests session with our User-Agent and, if given, the driver's cookies."""
+    s = requests.Session()
+    s.headers.update({"User-Agent": USER_AGENT})
+    if driver is not None:
+        for cookie in driver.get_cookies():
+            s.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+    return s
 
-def extract_pdf_content(driver, page_url, download_dir):
+
+def remote_size(session, url):
     """
-    Extract PDF content from a Brightspace page
+    Returns the remote size in bytes, or None if unknown. Tries a HEAD request
+    first and falls back to a zero-length Range request for servers that do not
+    answer HEAD.
     """
     try:
-        print(f"visiting PDF page: {page_url}")
-        driver.get(page_url)
-        time.sleep(3)  # Wait for page to load
-        
-        # Get the page title for filename
-        try:
-            title_elem = driver.find_element(By.CLASS_NAME, "d2l-page-title")
-            page_title = title_elem.text.strip()
-            if not page_title:
-                page_title = "document"
-        except Exception as e:
-            print(f"  Could not extract page title: {e}")
+        r = session.head(url, allow_redirects=True, timeout=30)
+        if r.ok and r.headers.get("Content-Length") and "gzip" not in r.headers.get("Content-Encoding", ""):
+            return int(r.headers["Content-Length"])
+
+        with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as r:
+            # Content-Range: bytes 0-0/123456
+            content_range = r.headers.get("Content-Range", "")
+            if r.status_code == 206 and "/" in content_range and not content_range.endswith("*"):
+                return int(content_range.rsplit("/", 1)[1])
+    except (requests.RequestException, ValueError):
+        pass
+    return None
+
+
+def download_file(session, url, filename):
+    """
+    Downloads `url` to `filename` unless a complete copy already exists.
+
+    Data is streamed into `{filename}.part` and only renamed into place once the
+    byte count matches Content-Length and the file structure verifies, so a crash
+    never leaves a truncated file under the final name. An existing `.part` is
+    resumed with a Range request when the server supports it. The block-hash
+    manifest (`{filename}.blocks.json`) is computed from the same chunks.
+    The transfer holds a global slot when multi_account.py set a budget.
+    Returns the final filename.
+
+    With STORAGE_BACKEND=s3 the data is streamed into object storage instead
+    and the s3:// URL of the object is returned.
+    """
+    if storage_backend() == S3:
+        target = object_url(filename)
+        state = check_stored(target)
+        if state != MISSING:
+            state = check_stored(target, remote_size(session, url))
+            if state == COMPLETE:
+                print(f"  Already uploaded, skipping: {target}")
+                return target
+            print(f"  Existing object is {state}, uploading again: {target}")
+        with global_slot():
+            return stream_to_object(session, url, filename)
+
+    if os.path.exists(filename):
+        state = check_file(filename, remote_size(session, url))
+        if state == COMPLETE:
+            print(f"  Already downloaded, skipping: {filename}")
+            if load_manifest(filename) is None:
+                # Downloaded before manifests existed, or changed since
+                write_manifest(filename)
+            return filename
+        print(f"  Existing file is {state}, downloading again: {filename}")
+        os.remove(filename)
+
+    part_path = filename + PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    hasher = None
+
+    with global_slot(), session.get(url, headers=headers, stream=True, timeout=60) as r:
+        if offset and r.status_code == 416:
+            # The part file already holds every byte
+            r.close()
+        else:
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                print("  Server ignored Range request, restarting download.")
+                offset = 0
+            elif offset:
+                print(f"  Resuming download at {offset} bytes.")
+
+            expected = None
+            if r.headers.get("Content-Length") and "gzip" not in r.headers.get("Content-Encoding", ""):
+                expected = offset + int(r.headers["Content-Length"])
+
+            # Resumed bytes are hashed from the part file; new ones as they arrive
+            hasher = resume_hasher(part_path) if offset else BlockHasher()
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=8192):
+                    f.write(chunk)
+                    hasher.update(chunk)
+
+            written = os.path.getsize(part_path)
+            if expected is not None and written != expected:
+                raise IOError(f"Incomplete download: got {written} of {expected} bytes")
+
+    state = check_file(part_path, ext=os.path.splitext(filename)[1])
+    if state != COMPLETE:
+        os.remove(part_path)
+        raise IOError(f"Downloaded file failed verification ({state}): {filename}")
+    os.replace(part_path, filename)
+    write_manifest(filename, hasher)
+    return filename
+
+
+
+def direct_file_url(page_url):
+    """
+    Derives the D2L file download URL of a content topic from its viewContent
+    URL, or returns None if the URL does not have the expected shape.
+    """
+    match = VIEW_CONTENT_PATTERN.match(page_url or "")
+    if not match:
+        return None
+    base, org_unit_id, topic_id = match.groups()
+    return f"{base}/d2l/le/content/{org_unit_id}/topics/files/download/{topic_id}/DirectFileTopicDownload"
+
+
+def le_api_version(session, base_url):
+    """Latest LE API version of the tenant (e.g. '1.74'), or None if the API is not reachable."""
+    with _le_versions_lock:
+        if base_url in _le_versions:
+            return _le_versions[base_url]
+    try:
+        r = session.get(f"{base_url}/d2l/api/versions/le", timeout=15)
+        if r.ok:
+            version = r.json().get("LatestVersion")
+            if version:
+                with _le_versions_lock:
+                    _le_versions[base_url] = version
+            return version
+    except (requests.RequestException, ValueError):
+        pass
+    return None
+
+
+def topic_title(session, page_url):
+    """
+    Title of a content topic from the LE API: the text the topic page shows
+    as d2l-page-title, so PDFs resolved with and without the browser get the
+    same filename. Returns None if the API cannot be used.
+    """
+    match = VIEW_CONTENT_PATTERN.match(page_url or "")
+    if not match:
+        return None
+    base, org_unit_id, topic_id = match.groups()
+    version = le_api_version(session, base)
+    if not version:
+        return None
+    try:
+        r = session.get(f"{base}/d2l/api/le/{version}/{org_unit_id}/content/topics/{topic_id}", timeout=30)
+        if r.ok and not is_login_page(r.url):
+            return (r.json().get("Title") or "").strip() or None
+    except (requests.RequestException, ValueError):
+        pass
+    return None
+
+
+def resolve_pdf_url_direct(session, page_url):
+    """
+    Resolves a PDF topic over plain HTTP, without a browser. The file URL is
+    derived from the topic and org unit IDs and confirmed with a one-byte Range
+    request; the filename comes from the topic title, as in resolve_pdf_url.
+    Returns (pdf_url, safe_title), or (None, None) if the topic is not a
+    downloadable PDF file (links, LTI tools, expired session, ...) or its
+    title cannot be read.
+    """
+    file_url = direct_file_url(page_url)
+    if not file_url:
+        return None, None
+    try:
+        with session.get(file_url, headers={"Range": "bytes=0-0"}, stream=True, timeout=30) as r:
+            if r.status_code not in (200, 206) or is_login_page(r.url):
+                return None, None
+            content_type = r.headers.get("Content-Type", "").lower()
+            match = DISPOSITION_FILENAME_PATTERN.search(r.headers.get("Content-Disposition", ""))
+            filename = urllib.parse.unquote(match.group(1)) if match else ""
+    except requests.RequestException:
+        return None, None
+
+    if "pdf" not in content_type and not filename.lower().endswith(".pdf"):
+        return None, None
+    title = topic_title(session, page_url)
+    if not title:
+        return None, None  # The browser path reads the title from the page
+    print(f"  Resolved PDF without browser: {file_url}")
+    return file_url, sanitize_filename(title)
+
+
+def resolve_pdf_url(driver, page_url):
+    """
+    Loads a Brightspace PDF page and finds the PDF file URL.
+    Returns (pdf_url, safe_title); pdf_url is None if it could not be found.
+    """
+    print(f"visiting PDF page: {page_url}")
+    driver.get(page_url)
+    time.sleep(3)  # Wait for page to load
+    
+    # Get the page title for filename
+    try:
+        title_elem = driver.find_element(By.CLASS_NAME, "d2l-page-title")
+        page_title = title_elem.text.strip()
+        if not page_title:
             page_title = "document"
+    except Exception as e:
+        print(f"  Could not extract page title: {e}")
+        page_title = "document"
+    
+    safe_title = sanitize_filename(page_title)
+    
+    # Find the PDF iframe and extract source URL
+    try:
+        # Try finding the rendered pdf iframe
+        pdf_iframe = None
+        try:
+            pdf_iframe = driver.find_element(By.CLASS_NAME, "d2l-fileviewer-rendered-pdf")
+        except:
+            pass
         
-        safe_title = sanitize_filename(page_title)
+        iframe_src = None
+        if pdf_iframe:
+            iframe_src = pdf_iframe.get_attribute('src')
         
-        # Find the PDF iframe and extract source URL
-        try:
-            # Try finding the rendered pdf iframe
-            pdf_iframe = None
-            try:
-                pdf_iframe = driver.find_element(By.CLASS_NAME, "d2l-fileviewer-rendered-pdf")
+        # If not found, look for PDF JS viewer
+        if not iframe_src:
+            try: 
+                # Checking for alternative PDF viewer class from user prototype logic (syllabus)
+                pdf_element = driver.find_element(By.CLASS_NAME, "d2l-fileviewer-pdf-pdfjs")
+                data_location = pdf_element.get_attribute('data-location')
+                if data_location:
+                    # Direct download link found
+                    print(f"  Found direct PDF data-location: {data_location}")
+                    return data_location, safe_title
             except:
                 pass
-            
-            iframe_src = None
-            if pdf_iframe:
-                iframe_src = pdf_iframe.get_attribute('src')
-            
-            # If not found, look for PDF JS viewer
-            if not iframe_src:
-                try: 
-                    # Checking for alternative PDF viewer class from user prototype logic (syllabus)
-                    pdf_element = driver.find_element(By.CLASS_NAME, "d2l-fileviewer-pdf-pdfjs")
-                    data_location = pdf_element.get_attribute('data-location')
-                    if data_location:
-                        # Direct download link found
-                        print(f"  Found direct PDF data-location: {data_location}")
-                        
-                        # Download logic for direct link
-                        os.makedirs(download_dir, exist_ok=True)
-                        filename = os.path.join(download_dir, f"{safe_title}.pdf")
-                        print(f"  Downloading PDF to: {filename}")
-                        
-                        headers = {"User-Agent": USER_AGENT}
-                        # Cookies are already in the driver session, but requests needs them passed
-                        # Or we can just use requests with headers if the session cookies are not strictly required for the asset URL 
-                        # (usually they are for d2l assets). 
-                        # We should create a session that shares cookies with the driver.
-                        
-                        s = requests.Session()
-                        s.headers.update(headers)
-                        for cookie in driver.get_cookies():
-                            s.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
-
-                        with s.get(data_location, stream=True) as r:
-                            r.raise_for_status()
-                            with open(filename, 'wb') as f:
-                                for chunk in r.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                        print(f"  PDF download complete: {filename}\n")
-                        return True
-                except:
-                    pass
-
-            if iframe_src and 'file=' in iframe_src:
-                # Extract the file parameter from the iframe src
-                file_param = iframe_src.split('file=')[1].split('&')[0]
-                # URL decode the file parameter
-                pdf_url = urllib.parse.unquote(file_param)
-                # Construct the full URL
-                if not pdf_url.startswith("http"):
-                    pdf_url = "https://purdue.brightspace.com" + pdf_url
-                print(f"  Extracted PDF URL: {pdf_url}")
-                
-                # Download the PDF
-                os.makedirs(download_dir, exist_ok=True)
-                filename = os.path.join(download_dir, f"{safe_title}.pdf")
-                print(f"  Downloading PDF to: {filename}")
-                
-                headers = {"User-Agent": USER_AGENT}
-                
-                # Need session with cookies
-                s = requests.Session()
-                s.headers.update(headers)
-                for cookie in driver.get_cookies():
-                   s.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
-
-                with s.get(pdf_url, stream=True) as r:
-                    r.raise_for_status()
-                    with open(filename, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                print(f"  PDF download complete: {filename}\n")
-                return True
-            else:
-                print(f"  Could not extract PDF URL from page elements")
-                return False
-                
-        except Exception as e:
-            print(f"  Error extraction logic: {e}")
+
+        if iframe_src and 'file=' in iframe_src:
+            # Extract the file parameter from the iframe src
+            file_param = iframe_src.split('file=')[1].split('&')[0]
+            # URL decode the file parameter
+            pdf_url = urllib.parse.unquote(file_param)
+            # Construct the full URL
+            if not pdf_url.startswith("http"):
+                pdf_url = get_tenant()["base_url"] + pdf_url
+            print(f"  Extracted PDF URL: {pdf_url}")
+            return pdf_url, safe_title
+        
+        print(f"  Could not extract PDF URL from page elements")
+    except Exception as e:
+        print(f"  Error extraction logic: {e}")
+    return None, safe_title
+
+
+def extract_pdf_content(driver, page_url, download_dir):
+    """
+    Extract PDF content from a Brightspace page. The file URL is resolved over
+    plain HTTP first; the browser is only used if that fails.
+    """
+    try:
+        # Cookies are already in the driver session, but requests needs them passed
+        # (d2l assets usually require the session cookies).
+        s = make_session(driver)
+        pdf_url, safe_title = resolve_pdf_url_direct(s, page_url)
+        if not pdf_url:
+            pdf_url, safe_title = resolve_pdf_url(driver, page_url)
+        if not pdf_url:
             return False
+
+        # Download the PDF
+        os.makedirs(download_dir, exist_ok=True)
+        filename = os.path.join(download_dir, f"{safe_title}.pdf")
+        print(f"  Downloading PDF to: {filename}")
+        
+        filename = download_file(s, pdf_url, filename)
+        print(f"  PDF download complete: {filename}\n")
+        return filename
             
+    except (requests.RequestException, IOError):
+        raise  # Let the caller classify and retry transfer errors
     except Exception as e:
         print(f"  Error extracting PDF content: {e}")
         return False
 
 
-def extract_and_download(driver, page_url, download_dir):
-    # Record the current number of requests before loading the page
-    start_idx = len(driver.requests)
-    print(f"Current requests: {start_idx}")
+def resolve_video_url(driver, page_url):
+    """
+    Loads a Brightspace video page and captures the Kaltura download URL from
+    its network traffic. Returns (video_url, safe_title); video_url is None if
+    no segment URL was seen.
+    """
+    # Mark where this page's traffic starts before loading it
+    marker = begin_capture(driver)
     print(f"Visiting: {page_url}")
     driver.get(page_url)
 
-    time.sleep(10)  # Wait for network requests to be made after play
-
-    # Only look at new requests
-    new_requests = driver.requests[start_idx:]
-    print(f"New requests: {len(new_requests)}")
-
     # Extract the page title for filename
     try:
         title_elem = WebDriverWait(driver, 10).until(
@@ -175,41 +383,34 @@ def extract_and_download(driver, page_url, download_dir):
         page_title = "video"
     
     safe_title = sanitize_filename(page_title)
-    seg_url = None
-    
-    # Save all requests to a CSV file for inspection (optional, keeping for debug)
-    # requests_data = [] 
-    # Implementation omitted for brevity as it was commented out in original
-
-    csv_path = os.path.join(download_dir, f"requests_dump_{int(time.time())}.csv")
-    # print(f"Requests saved to {csv_path}") 
-
-    for request in new_requests:
-        if request.response and "-v1-a1.ts" in request.url:
-            seg_url = request.url
-            print(f"Found segment URL: {seg_url}")
-            break
-            
-    if not seg_url:
+
+    # Wait for the player to request its first segment
+    seg_url = find_request_url(driver, marker, SEGMENT_URL_PATTERN, timeout=SEGMENT_TIMEOUT)
+    if seg_url:
+        print(f"Found segment URL: {seg_url}")
+    else:
         print("No segment URL found on this page.")
-        return
+        return None, safe_title
 
     # Modify the URL: replace first 'hls' with 'pd'
     new_url = seg_url.replace("hls", "pd", 1)
     print(f"Modified URL: {new_url}")
+    return new_url, safe_title
+
+
+def extract_and_download(driver, page_url, download_dir):
+    video_url, safe_title = resolve_video_url(driver, page_url)
+    if not video_url:
+        return None
 
     # Use flat output directory
     os.makedirs(download_dir, exist_ok=True)
     filename = os.path.join(download_dir, f"{safe_title}.mp4")
     print(f"Downloading to: {filename}")
     
-    headers = {"User-Agent": USER_AGENT}
-    with requests.get(new_url, headers=headers, stream=True) as r:
-        r.raise_for_status()
-        with open(filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+    filename = download_file(make_session(), video_url, filename)
     print("Download complete.")
+    return filename
 
 def main():
     parser = argparse.ArgumentParser(description="Extract Kaltura videos from Brightspace.")
@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from execution.queue_lease import SLOT_DIR_ENV, SLOTS_ENV, reset_leases
+    from execution.tenant_config import LOGIN_REQUIRED_EXIT, NONINTERACTIVE_ENV
+except ImportError:
+    from queue_lease import SLOT_DIR_ENV, SLOTS_ENV, reset_leases
+    from tenant_config import LOGIN_REQUIRED_EXIT, NONINTERACTIVE_ENV
+
+# Project Root Setup
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXECUTION_DIR = os.path.join(PROJECT_ROOT, "execution")
+ACCOUNTS_FILE = os.path.join(PROJECT_ROOT, "accounts.json")
+SLOT_DIR = os.path.join(PROJECT_ROOT, "global_slots")
+
+DEFAULT_MAX_PARALLEL = 3  # Accounts processed at the same time
+DEFAULT_GLOBAL_SLOTS = 4  # Transfers running at once across all accounts
+
+
+def load_accounts(path):
+    """
+    Reads the accounts file: a JSON list of
+    {"name", "env_file", "output_root", "downloader_args" (optional)}.
+    Relative paths are relative to the accounts file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+
+    base = os.path.dirname(os.path.abspath(path))
+    for account in accounts:
+        for field in ("name", "env_file", "output_root"):
+            if not account.get(field):
+                raise ValueError(f"Account entry {account} is missing '{field}'")
+        for field in ("env_file", "output_root"):
+            account[field] = os.path.join(base, account[field])
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names must be unique")
+    return accounts
+
+
+def account_env(account, slot_dir, slots):
+    """Environment of an account's subprocesses: its own env file, output root and the shared slots."""
+    env = dict(os.environ)
+    env["D2L_ENV_FILE"] = account["env_file"]
+    env["D2L_OUTPUT_ROOT"] = account["output_root"]
+    env[SLOT_DIR_ENV] = slot_dir
+    env[SLOTS_ENV] = str(slots)
+    # Output goes to run.log, so a manual-login prompt would never be seen
+    env[NONINTERACTIVE_ENV] = "1"
+    env["PYTHONUNBUFFERED"] = "1"
+    return env
+
+
+def run_step(account, script, extra_args, env, log):
+    command = [sys.executable, os.path.join(EXECUTION_DIR, script), *extra_args]
+    log.write(f"\n=== {time.strftime('%Y-%m-%d %H:%M:%S')} {' '.join(command)}\n")
+    log.flush()
+    return subprocess.run(
+        command, env=env, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, cwd=PROJECT_ROOT
+    ).returncode
+
+
+def run_account(account, args):
+    """Runs the parser and then the downloader for one account. Returns (name, status)."""
+    name = account["name"]
+    os.makedirs(account["output_root"], exist_ok=True)
+    env = account_env(account, args.slot_dir, args.global_slots)
+    log_path = os.path.join(account["output_root"], "run.log")
+    print(f"[{name}] Starting (log: {log_path})")
+
+    started = time.time()
+    with open(log_path, "a", encoding="utf-8") as log:
+        if not args.skip_parse:
+            code = run_step(account, "brightspace_parser.py", [], env, log)
+            if code == LOGIN_REQUIRED_EXIT:
+                print(f"[{name}] Login failed; log in once by hand with this account's env file")
+                return name, "login_required"
+            if code != 0:
+                print(f"[{name}] Parser failed with exit code {code}")
+                return name, "parse_failed"
+            print(f"[{name}] Parser finished.")
+
+        downloader_args = ["--worker-id", name, *account.get("downloader_args", [])]
+        code = run_step(account, "batch_downloader.py", downloader_args, env, log)
+
+    if code == LOGIN_REQUIRED_EXIT:
+        print(f"[{name}] Login failed; log in once by hand with this account's env file")
+        return name, "login_required"
+    if code != 0:
+        print(f"[{name}] Downloader failed with exit code {code}")
+        return name, "download_failed"
+    print(f"[{name}] Finished in {time.time() - started:.0f}s")
+    return name, "done"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the extraction pipeline for several Brightspace accounts at once.")
+    parser.add_argument("--accounts", default=ACCOUNTS_FILE, help="JSON list of accounts (default: accounts.json).")
+    parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL, help="Accounts processed at the same time (default: 3).")
+    parser.add_argument("--global-slots", type=int, default=DEFAULT_GLOBAL_SLOTS, help="Transfers running at once across all accounts (default: 4).")
+    parser.add_argument("--slot-dir", default=SLOT_DIR, help="Directory holding the global slot leases.")
+    parser.add_argument("--only", nargs="+", help="Run only these account names.")
+    parser.add_argument("--skip-parse", action="store_true", help="Reuse each account's existing download_queue.json.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.accounts):
+        print(f"Accounts file '{args.accounts}' not found.")
+        sys.exit(1)
+    accounts = load_accounts(args.accounts)
+    if args.only:
+        accounts = [account for account in accounts if account["name"] in args.only]
+    if not accounts:
+        print("No accounts to run.")
+        return
+
+    # Slot leases of an earlier, interrupted run would otherwise block until they expire
+    reset_leases(args.slot_dir)
+
+    print(f"Running {len(accounts)} accounts, {args.max_parallel} at a time, {args.global_slots} global transfer slots.")
+    with ThreadPoolExecutor(max_workers=args.max_parallel) as pool:
+        results = list(pool.map(lambda account: run_account(account, args), accounts))
+
+    print("\nSummary:")
+    for name, status in results:
+        print(f"  {name}: {status}")
+    if any(status != "done" for _, status in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
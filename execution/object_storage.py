@@ -0,0 +1,250 @@
+import mimetypes
+import os
+import threading
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # Only needed with STORAGE_BACKEND=s3
+    boto3 = None
+    ClientError = Exception
+
+try:
+    from execution.file_integrity import COMPLETE, CORRUPT, MISSING, PDF_TAIL_BYTES, TRUNCATED, check_file
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from file_integrity import COMPLETE, CORRUPT, MISSING, PDF_TAIL_BYTES, TRUNCATED, check_file
+    from tenant_config import OUTPUT_ROOT
+
+# Where transfers go, selected with STORAGE_BACKEND in the environment:
+#   local - files under downloads/ (default)
+#   s3    - streamed into multipart uploads to an S3-compatible endpoint, with
+#           the downloads/ layout as object keys. Nothing is staged on disk.
+STORAGE_ENV_VAR = "STORAGE_BACKEND"
+LOCAL = "local"
+S3 = "s3"
+S3_SCHEME = "s3://"
+
+# Each part is held in memory once, so this bounds memory per transfer.
+# S3 requires at least 5 MiB for every part but the last.
+DEFAULT_PART_SIZE_MB = 16
+MIN_PART_SIZE = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+HEAD_BYTES = 16  # Enough for the %PDF- / ftyp signatures
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def storage_backend():
+    return (os.getenv(STORAGE_ENV_VAR) or LOCAL).lower()
+
+
+def s3_settings():
+    """Bucket, key prefix, endpoint and part size from the environment (S3_*)."""
+    part_size = int(float(os.getenv("S3_PART_SIZE_MB") or DEFAULT_PART_SIZE_MB) * 1024 * 1024)
+    return {
+        "bucket": os.getenv("S3_BUCKET"),
+        "prefix": (os.getenv("S3_PREFIX") or "").strip("/"),
+        "endpoint_url": os.getenv("S3_ENDPOINT_URL") or None,  # e.g. http://localhost:9000 for MinIO
+        "region": os.getenv("S3_REGION") or None,
+        "part_size": max(MIN_PART_SIZE, part_size),
+    }
+
+
+def s3_client():
+    """Shared boto3 client (boto3 clients are thread-safe). Credentials come from the usual AWS_* variables."""
+    global _client
+    if boto3 is None:
+        raise RuntimeError("STORAGE_BACKEND=s3 needs boto3 (pip install boto3)")
+    with _client_lock:
+        if _client is None:
+            settings = s3_settings()
+            if not settings["bucket"]:
+                raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET")
+            _client = boto3.client("s3", endpoint_url=settings["endpoint_url"], region_name=settings["region"])
+    return _client
+
+
+def object_key(filename):
+    """Object key of a local target path: its path below OUTPUT_ROOT (downloads/{course}/...), with S3_PREFIX."""
+    rel = os.path.relpath(os.path.abspath(filename), OUTPUT_ROOT)
+    if rel.startswith(".."):
+        rel = os.path.basename(filename)
+    key = rel.replace(os.sep, "/")
+    prefix = s3_settings()["prefix"]
+    return f"{prefix}/{key}" if prefix else key
+
+
+def object_url(filename):
+    return f"{S3_SCHEME}{s3_settings()['bucket']}/{object_key(filename)}"
+
+
+def _split_object_url(url):
+    bucket, _, key = url[len(S3_SCHEME):].partition("/")
+    return bucket, key
+
+
+def _object_size(bucket, key):
+    try:
+        return s3_client().head_object(Bucket=bucket, Key=key)["ContentLength"]
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def stored_size(path):
+    """Size of a stored file (local path or s3:// URL), or None if it does not exist."""
+    if not path:
+        return None
+    if path.startswith(S3_SCHEME):
+        return _object_size(*_split_object_url(path))
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def check_stored(path, expected_size=None):
+    """
+    check_file for any backend. Objects are checked by size only; their
+    structure was verified while streaming.
+    """
+    if not (path or "").startswith(S3_SCHEME):
+        return check_file(path, expected_size)
+    size = stored_size(path)
+    if size is None:
+        return MISSING
+    if size == 0:
+        return TRUNCATED
+    if expected_size is not None and size != expected_size:
+        return TRUNCATED if size < expected_size else CORRUPT
+    return COMPLETE
+
+
+def _find_upload(client, bucket, key):
+    """UploadId of the newest unfinished multipart upload of `key`, if any."""
+    uploads = client.list_multipart_uploads(Bucket=bucket, Prefix=key).get("Uploads", [])
+    uploads = [upload for upload in uploads if upload["Key"] == key]
+    if not uploads:
+        return None
+    return max(uploads, key=lambda upload: upload["Initiated"])["UploadId"]
+
+
+def _resumable_parts(client, bucket, key, upload_id, part_size):
+    """
+    Parts 1..n of an unfinished upload that are full-sized and contiguous.
+    A short or missing part ends the run; everything after it is sent again.
+    """
+    found = {}
+    for page in client.get_paginator("list_parts").paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            found[part["PartNumber"]] = part
+
+    parts = []
+    while len(parts) + 1 in found and found[len(parts) + 1]["Size"] == part_size:
+        part = found[len(parts) + 1]
+        parts.append({"PartNumber": part["PartNumber"], "ETag": part["ETag"]})
+    return parts
+
+
+def _fetch_range(session, url, byte_range):
+    with session.get(url, headers={"Range": f"bytes={byte_range}"}, timeout=60) as r:
+        r.raise_for_status()
+        return r.content
+
+
+def _verify_stream(ext, head, tail):
+    """Signature checks that need only the first and last bytes of a transfer."""
+    ext = ext.lower()
+    if ext == ".mp4" and head[4:8] != b"ftyp":
+        return "missing ftyp box"
+    if ext == ".pdf":
+        if not head.startswith(b"%PDF-"):
+            return "missing %PDF- header"
+        if b"%%EOF" not in tail:
+            return "missing %%EOF trailer"
+    return None
+
+
+def stream_to_object(session, url, filename):
+    """
+    Streams `url` into a multipart upload under the object key of `filename`
+    without touching local disk. At most one part is buffered in memory.
+    An unfinished upload of the same key is resumed after its last full part
+    with a Range request. Returns the s3:// URL of the object.
+    """
+    client = s3_client()
+    settings = s3_settings()
+    bucket, part_size = settings["bucket"], settings["part_size"]
+    key = object_key(filename)
+    ext = os.path.splitext(filename)[1]
+
+    upload_id = _find_upload(client, bucket, key)
+    parts = _resumable_parts(client, bucket, key, upload_id, part_size) if upload_id else []
+    if upload_id is None:
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+
+    offset = len(parts) * part_size
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    head, tail = b"", b""
+
+    def upload_part(data):
+        response = client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=len(parts) + 1, Body=data
+        )
+        parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+
+    with session.get(url, headers=headers, stream=True, timeout=60) as r:
+        if not (offset and r.status_code == 416):  # 416: the uploaded parts already hold every byte
+            r.raise_for_status()
+            if offset and r.status_code != 206:
+                print("  Server ignored Range request, restarting upload.")
+                offset, parts = 0, []
+            elif offset:
+                print(f"  Resuming upload at part {len(parts) + 1} ({offset} bytes).")
+
+            expected = None
+            if r.headers.get("Content-Length") and "gzip" not in r.headers.get("Content-Encoding", ""):
+                expected = offset + int(r.headers["Content-Length"])
+
+            # A fresh buffer per part, handed to boto3 as is: slicing a full
+            # part out of one long buffer would copy it and then shift the rest.
+            buffer = bytearray()
+            received = 0
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                received += len(chunk)
+                if not offset and len(head) < HEAD_BYTES:
+                    head = (head + chunk)[:HEAD_BYTES]
+                tail = (tail + chunk)[-PDF_TAIL_BYTES:]
+                view = memoryview(chunk)
+                while view:
+                    take = min(len(view), part_size - len(buffer))
+                    buffer += view[:take]
+                    view = view[take:]
+                    if len(buffer) == part_size:
+                        upload_part(buffer)
+                        buffer = bytearray()
+            # The last part may be short (or the only part of a small file)
+            if buffer or not parts:
+                upload_part(buffer)
+
+            if expected is not None and offset + received != expected:
+                # Full parts stay on the server; the next attempt resumes after them
+                raise IOError(f"Incomplete download: got {offset + received} of {expected} bytes")
+
+    # Bytes sent before a resume are not in memory; fetch the few needed for the checks
+    if offset and len(head) < HEAD_BYTES:
+        head = _fetch_range(session, url, f"0-{HEAD_BYTES - 1}")
+    if offset and len(tail) < PDF_TAIL_BYTES and ext.lower() == ".pdf":
+        tail = _fetch_range(session, url, f"-{PDF_TAIL_BYTES}")
+
+    reason = _verify_stream(ext, head, tail)
+    if reason:
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        print(f"  [VERIFY] {os.path.basename(filename)}: {reason}")
+        raise IOError(f"Downloaded file failed verification (corrupt): {filename}")
+
+    client.complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+    )
+    return f"{S3_SCHEME}{bucket}/{key}"
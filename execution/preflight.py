@@ -0,0 +1,287 @@
+import json
+import os
+import shutil
+import socket
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+try:
+    from execution.kaltura_video_extractor import (
+        make_session,
+        remote_size,
+        resolve_pdf_url,
+        resolve_pdf_url_direct,
+        resolve_video_url,
+    )
+    from execution.object_storage import S3, storage_backend
+    from execution.queue_lease import item_key
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from kaltura_video_extractor import (
+        make_session,
+        remote_size,
+        resolve_pdf_url,
+        resolve_pdf_url_direct,
+        resolve_video_url,
+    )
+    from object_storage import S3, storage_backend
+    from queue_lease import item_key
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+DOWNLOADS_DIR = os.path.join(OUTPUT_ROOT, "downloads")
+PREFLIGHT_FILE = os.path.join(OUTPUT_ROOT, "preflight.json")
+SUMMARY_FILE = os.path.join(OUTPUT_ROOT, "preflight_summary.txt")  # Next to video_titles.txt
+
+HEAD_WORKERS = 16
+RESOLVE_WORKERS = 16  # Parallel browserless PDF resolutions
+DEFAULT_DISK_RESERVE = 1024 ** 3  # Keep 1 GiB free
+THROUGHPUT_SAMPLES = 20  # Recent downloads used for the ETA
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def item_target_dir(item):
+    """Absolute target directory of a queue item (relative paths are relative to OUTPUT_ROOT)."""
+    target_dir = item.get("target_dir")
+    if target_dir and not os.path.isabs(target_dir):
+        target_dir = os.path.join(OUTPUT_ROOT, target_dir)
+    return target_dir
+
+
+def item_course(item):
+    """Course folder name of an item: the first path component below downloads/."""
+    rel = os.path.relpath(item_target_dir(item) or "", DOWNLOADS_DIR)
+    if rel.startswith(".."):
+        return "unknown"
+    return rel.split(os.sep)[0]
+
+
+def load_preflight(path=PREFLIGHT_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_preflight(items, path=PREFLIGHT_FILE):
+    """
+    Adds the resolved URLs, filenames and sizes of `items` to preflight.json,
+    so later runs and the other shard workers can reuse them.
+    """
+    preflight = load_preflight(path)
+    for item in items:
+        if item.get("media_url"):
+            preflight[item_key(item)] = {
+                "url": item["url"],
+                "media_url": item["media_url"],
+                "filename": item.get("filename"),
+                "size": item.get("size"),
+                "probed": time.time(),
+            }
+    # Atomic rename: other workers may be reading it from the shared output root
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(preflight, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def apply_preflight(queue, preflight):
+    """Copies resolved URLs, filenames and sizes from an earlier pre-flight onto the queue items."""
+    for item in queue:
+        known = preflight.get(item_key(item))
+        if known:
+            for field in ("media_url", "filename", "size"):
+                if known.get(field) is not None:
+                    item.setdefault(field, known[field])
+
+
+def _parallel_map(fn, items, workers, controller=None):
+    """Thread pool map with a fixed worker count, or adaptive with an AIMD controller."""
+    if controller is not None:
+        return controller.map(fn, items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items))
+
+
+def resolve_pdfs_direct(session, items, workers=RESOLVE_WORKERS, controller=None):
+    """
+    Resolves PDF items over plain HTTP in parallel, without touching the
+    browser. With an AIMD `controller` the parallelism adapts to the server.
+    """
+    pending = [
+        item for item in items
+        if item.get("type") == "pdf" and not (item.get("media_url") and item.get("filename"))
+    ]
+    if not pending:
+        return
+    if controller is not None:
+        controller.watch_session(session)
+    print(f"\nResolving {len(pending)} PDFs without browser ({'adaptive' if controller else workers} parallel)...")
+    results = _parallel_map(lambda it: resolve_pdf_url_direct(session, it["url"]), pending, workers, controller)
+    for item, (pdf_url, safe_title) in zip(pending, results):
+        if pdf_url:
+            item["media_url"] = pdf_url
+            item["filename"] = os.path.join(item_target_dir(item), f"{safe_title}.pdf")
+    resolved = sum(1 for item in pending if item.get("media_url"))
+    print(f"Resolved {resolved} of {len(pending)} PDFs directly; the rest fall back to the browser.")
+
+
+def resolve_items(driver, items, controller=None):
+    """
+    Resolves the media URL and final filename of every item. PDFs are tried
+    over plain HTTP first; everything else costs one page load.
+    """
+    resolve_pdfs_direct(make_session(driver), items, controller=controller)
+    for i, item in enumerate(items):
+        if item.get("media_url") and item.get("filename"):
+            continue
+        print(f"\n[PREFLIGHT {i+1}/{len(items)}] Resolving: {item.get('title')}")
+        try:
+            if item.get("type", "video") == "pdf":
+                media_url, safe_title = resolve_pdf_url(driver, item["url"])
+                ext = ".pdf"
+            else:
+                media_url, safe_title = resolve_video_url(driver, item["url"])
+                ext = ".mp4"
+        except Exception as e:
+            print(f"  Could not resolve: {e}")
+            continue
+        if media_url:
+            item["media_url"] = media_url
+            item["filename"] = os.path.join(item_target_dir(item), f"{safe_title}{ext}")
+
+
+def probe_sizes(session, items, workers=HEAD_WORKERS, controller=None):
+    """Fetches the remote size of every resolved item with concurrent HEAD/Range requests."""
+    if controller is not None:
+        workers = controller.maximum
+        controller.watch_session(session)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    pending = [item for item in items if item.get("media_url") and item.get("size") is None]
+    print(f"\nProbing sizes of {len(pending)} items with {'adaptive' if controller else workers} parallel requests...")
+    sizes = _parallel_map(lambda it: remote_size(session, it["media_url"]), pending, workers, controller)
+    for item, size in zip(pending, sizes):
+        item["size"] = size
+
+
+def recent_throughput(previous):
+    """Median bytes/second of recent successful downloads, or None without history."""
+    samples = [
+        entry for entry in previous.values()
+        if entry.get("status") == "done" and entry.get("size") and entry.get("seconds")
+    ]
+    samples.sort(key=lambda entry: entry["finished"])
+    rates = [entry["size"] / entry["seconds"] for entry in samples[-THROUGHPUT_SAMPLES:]]
+    return statistics.median(rates) if rates else None
+
+
+def free_disk_bytes(path=DOWNLOADS_DIR):
+    # The downloads folder may not exist yet; measure the closest existing parent.
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+
+def admit(items, free_bytes, reserve):
+    """
+    Splits items into (admitted, postponed) in queue order so the admitted ones
+    fit on disk with `reserve` bytes to spare. Bytes already in a `.part` file
+    do not count again. Items of unknown size are admitted.
+    """
+    budget = free_bytes - reserve
+    admitted, postponed = [], []
+    for item in items:
+        needed = item.get("size") or 0
+        filename = item.get("filename")
+        if needed and filename and os.path.exists(filename + ".part"):
+            needed -= os.path.getsize(filename + ".part")
+        if needed > budget:
+            postponed.append(item)
+            continue
+        budget -= needed
+        admitted.append(item)
+    return admitted, postponed
+
+
+def write_summary(items, postponed, free_bytes, reserve, throughput, path=SUMMARY_FILE):
+    totals = {}
+    unknown = 0
+    for item in items:
+        course = totals.setdefault(item_course(item), {})
+        count, size = course.get(item.get("type", "video"), (0, 0))
+        course[item.get("type", "video")] = (count + 1, size + (item.get("size") or 0))
+        if item.get("size") is None:
+            unknown += 1
+
+    total_bytes = sum(item.get("size") or 0 for item in items)
+    admitted_bytes = total_bytes - sum(item.get("size") or 0 for item in postponed)
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("Brightspace Pre-flight Report\n")
+        f.write("=============================\n\n")
+        f.write(f"Generated: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"Items: {len(items)} ({unknown} of unknown size)\n")
+        f.write(f"Total size: {format_bytes(total_bytes)}\n")
+        f.write(f"Free disk: {format_bytes(free_bytes)} (keeping {format_bytes(reserve)} in reserve)\n")
+        if throughput:
+            f.write(f"Estimated duration: {format_duration(admitted_bytes / throughput)} at {format_bytes(throughput)}/s (median of recent downloads)\n")
+        else:
+            f.write("Estimated duration: unknown (no download history yet)\n")
+
+        for course_name in sorted(totals):
+            f.write(f"\n{'='*50}\n")
+            f.write(f"COURSE: {course_name}\n")
+            f.write(f"{'='*50}\n")
+            for item_type, (count, size) in sorted(totals[course_name].items()):
+                f.write(f"  {item_type}: {count} items, {format_bytes(size)}\n")
+
+        if postponed:
+            f.write(f"\nPOSTPONED (does not fit on disk): {len(postponed)} items, {format_bytes(total_bytes - admitted_bytes)}\n")
+            for item in postponed:
+                f.write(f"  - {item.get('title')} ({format_bytes(item.get('size') or 0)})\n")
+
+    print(f"Pre-flight summary written to {path}")
+
+
+def run_preflight(driver, items, previous, reserve=DEFAULT_DISK_RESERVE, controller=None, resolve=True):
+    """
+    Resolves and sizes all items before any transfer starts, writes the summary
+    and preflight.json, and returns (admitted, postponed). With `resolve` False
+    the items already carry the results of another worker's pre-flight: only
+    the disk admission runs, and nothing is written.
+    """
+    if resolve:
+        resolve_items(driver, items, controller)
+        probe_sizes(make_session(driver), items, controller=controller)
+
+    free_bytes = free_disk_bytes()
+    if storage_backend() == S3:
+        # Nothing is staged on local disk
+        admitted, postponed = list(items), []
+    else:
+        admitted, postponed = admit(items, free_bytes, reserve)
+    if resolve:
+        write_summary(items, postponed, free_bytes, reserve, recent_throughput(previous))
+        save_preflight(items)
+
+    if postponed:
+        print(f"{len(postponed)} items do not fit on disk and are postponed.")
+    return admitted, postponed
@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+LEASE_DIR = os.path.join(OUTPUT_ROOT, "queue_locks")
+RESULTS_DIR = os.path.join(OUTPUT_ROOT, "queue_results")
+STATUS_FILE = os.path.join(OUTPUT_ROOT, "download_status.json")
+
+# Shared transfer budget across processes (set by multi_account.py): a
+# directory of `slot-N` leases on which every process must hold one lease per
+# running transfer.
+SLOT_DIR_ENV = "D2L_SLOT_DIR"
+SLOTS_ENV = "D2L_SLOTS"
+SLOT_POLL_SECONDS = 2
+
+# A lease is renewed every TTL/3 by its owner, so it only expires if the
+# owning worker died (or lost the share) for a full TTL.
+DEFAULT_LEASE_TTL = 15 * 60
+
+
+def item_key(item):
+    """Stable key for a queue item, shared by every worker that reads the same queue."""
+    return hashlib.sha1(item["url"].encode("utf-8")).hexdigest()[:20]
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _lease_path(lease_dir, key):
+    return os.path.join(lease_dir, f"{key}.lease")
+
+
+def _done_path(lease_dir, key):
+    return os.path.join(lease_dir, f"{key}.done")
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path, data):
+    # Write to a temp file and rename over the target: rename is atomic on
+    # POSIX filesystems including NFS, so readers never see a half-written file.
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _lease_expired(path, lease, ttl):
+    if lease and "expires" in lease:
+        return lease["expires"] < time.time()
+    # Unreadable lease: either being written right now or left half-written
+    # by a crash. Fall back to the file age.
+    try:
+        return os.path.getmtime(path) + ttl < time.time()
+    except FileNotFoundError:
+        return True
+
+
+def is_done(lease_dir, key):
+    return os.path.exists(_done_path(lease_dir, key))
+
+
+def _reclaim(path, lease, worker_id, ttl):
+    """
+    Replaces an expired lease with our own. Returns True if this worker now
+    owns it.
+
+    Several workers may find the same lease expired. Each expired lease has a
+    generation, and only the worker whose O_EXCL create of the reclaim marker
+    for that generation succeeds may replace it. The new lease (generation + 1)
+    is written to a private temp file and renamed over the stale one in one
+    atomic step, then read back to confirm ownership.
+    """
+    generation = (lease or {}).get("generation", 0)
+    marker = f"{path}.{generation}.reclaim"
+    try:
+        os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        # Another worker is reclaiming this generation right now. A marker
+        # older than the TTL was left by a worker that died mid-reclaim.
+        if _lease_expired(marker, None, ttl):
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass
+        return False
+
+    # The owner may have renewed, or released the item, since our read
+    current = _read_json(path)
+    if (current is None and not os.path.exists(path)) or (current != lease and not _lease_expired(path, current, ttl)):
+        os.remove(marker)
+        return False
+
+    _write_json_atomic(path, {
+        "worker": worker_id,
+        "generation": generation + 1,
+        "claimed": time.time(),
+        "expires": time.time() + ttl,
+    })
+    claimed = _read_json(path)
+    # Late reclaimers of the old lease now see a live lease and back off
+    os.remove(marker)
+    if not claimed or claimed.get("worker") != worker_id or claimed.get("generation") != generation + 1:
+        return False
+    print(f"  [LEASE] Reclaimed expired lease {os.path.basename(path)} (was {lease.get('worker') if lease else 'unknown'})")
+    return True
+
+
+def try_claim(lease_dir, key, worker_id, ttl=DEFAULT_LEASE_TTL):
+    """
+    Tries to take the lease for `key`. Returns True if this worker now owns it.
+    Expired leases of crashed workers are reclaimed.
+    """
+    os.makedirs(lease_dir, exist_ok=True)
+    if is_done(lease_dir, key):
+        return False
+
+    path = _lease_path(lease_dir, key)
+    try:
+        # O_EXCL creation is the lock primitive: exactly one worker wins.
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        lease = _read_json(path)
+        if not _lease_expired(path, lease, ttl):
+            return False
+        return _reclaim(path, lease, worker_id, ttl)
+
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"worker": worker_id, "generation": 0, "claimed": time.time(), "expires": time.time() + ttl}, f)
+    return True
+
+
+def renew(lease_dir, key, worker_id, ttl=DEFAULT_LEASE_TTL):
+    """
+    Extends a lease we own. Returns False if the lease was lost, including
+    when it already expired: another worker may be reclaiming it right now.
+    """
+    path = _lease_path(lease_dir, key)
+    lease = _read_json(path)
+    if not lease or lease.get("worker") != worker_id or _lease_expired(path, lease, ttl):
+        return False
+    lease["expires"] = time.time() + ttl
+    _write_json_atomic(path, lease)
+    return True
+
+
+def release(lease_dir, key, worker_id, status=None):
+    """
+    Drops our lease. If `status` is given the item is marked done so no other
+    worker picks it up again in this job.
+    """
+    if status:
+        _write_json_atomic(_done_path(lease_dir, key), {"worker": worker_id, "status": status, "finished": time.time()})
+    path = _lease_path(lease_dir, key)
+    lease = _read_json(path)
+    if lease and lease.get("worker") == worker_id:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def reset_leases(lease_dir):
+    """Clears all leases and done markers, starting a fresh sharded job."""
+    if not os.path.isdir(lease_dir):
+        return
+    for name in os.listdir(lease_dir):
+        try:
+            os.remove(os.path.join(lease_dir, name))
+        except OSError:
+            pass
+
+
+def start_heartbeat(lease_dir, key, worker_id, ttl=DEFAULT_LEASE_TTL, lost=None):
+    """
+    Renews the lease in a background thread. Set the returned event to stop.
+    If a renewal fails, the `lost` event is set so the owner can drop the item.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(ttl / 3):
+            if not renew(lease_dir, key, worker_id, ttl):
+                print(f"  [LEASE] Warning: lost lease {key}")
+                if lost is not None:
+                    lost.set()
+                return
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
+
+
+def _slot_budget():
+    """(slot_dir, slots) of the shared transfer budget, or None when none is set."""
+    slot_dir = os.getenv(SLOT_DIR_ENV)
+    slots = int(os.getenv(SLOTS_ENV) or 0)
+    if not slot_dir or slots <= 0:
+        return None
+    return slot_dir, slots
+
+
+def _try_slot(slot_dir, slots, worker_id, ttl):
+    for i in range(slots):
+        if try_claim(slot_dir, f"slot-{i}", worker_id, ttl):
+            return f"slot-{i}"
+    return None
+
+
+@contextmanager
+def global_slot(worker_id=None, ttl=DEFAULT_LEASE_TTL):
+    """
+    Holds one of the D2L_SLOTS leases in D2L_SLOT_DIR while the block runs,
+    waiting for a free one first. Does nothing when no global budget is set.
+    Wrap single transfers only, so page loads and retry backoffs do not
+    hold a slot.
+    """
+    budget = _slot_budget()
+    if budget is None:
+        yield None
+        return
+
+    slot_dir, slots = budget
+    worker_id = worker_id or default_worker_id()
+    key = _try_slot(slot_dir, slots, worker_id, ttl)
+    if key is None:
+        print(f"  [SLOT] All {slots} global transfer slots busy. Waiting...")
+    while key is None:
+        time.sleep(SLOT_POLL_SECONDS)
+        key = _try_slot(slot_dir, slots, worker_id, ttl)
+
+    stop_heartbeat = start_heartbeat(slot_dir, key, worker_id, ttl)
+    try:
+        yield key
+    finally:
+        stop_heartbeat.set()
+        release(slot_dir, key, worker_id)
+
+
+@asynccontextmanager
+async def global_slot_async(worker_id=None, ttl=DEFAULT_LEASE_TTL):
+    """global_slot for the asyncio engine: waits for a slot without blocking the event loop."""
+    budget = _slot_budget()
+    if budget is None:
+        yield None
+        return
+
+    slot_dir, slots = budget
+    worker_id = worker_id or default_worker_id()
+    key = _try_slot(slot_dir, slots, worker_id, ttl)
+    while key is None:
+        await asyncio.sleep(SLOT_POLL_SECONDS)
+        key = _try_slot(slot_dir, slots, worker_id, ttl)
+
+    stop_heartbeat = start_heartbeat(slot_dir, key, worker_id, ttl)
+    try:
+        yield key
+    finally:
+        stop_heartbeat.set()
+        release(slot_dir, key, worker_id)
+
+
+def record_result(results_dir, worker_id, key, record):
+    """
+    Appends a per-item result to this worker's own results file. Each worker
+    only ever writes its own file, so no locking is needed on the share.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    entry = {"key": key, "worker": worker_id, "finished": time.time(), **record}
+    with open(os.path.join(results_dir, f"{worker_id}.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_results(results_dir, status_file=STATUS_FILE):
+    """
+    Returns the latest result per item key across all workers, on top of the
+    results of earlier runs already merged into `status_file`.
+    """
+    latest = {}
+    for key, entry in (_read_json(status_file) or {}).items() if status_file else ():
+        if entry.get("finished") is not None:
+            latest[key] = {**entry, "key": key}
+    if not os.path.isdir(results_dir):
+        return latest
+    for name in sorted(os.listdir(results_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(results_dir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line from a crashed worker
+                key = entry.get("key")
+                if key and (key not in latest or entry["finished"] >= latest[key]["finished"]):
+                    latest[key] = entry
+    return latest
+
+
+def merge_results(results_dir, status_file, queue=None):
+    """
+    Merges every worker's results into a single status view. Queue items that
+    have no result yet are listed as pending.
+    """
+    latest = load_results(results_dir, status_file)
+    status = {}
+    for item in queue or []:
+        key = item_key(item)
+        status[key] = {"title": item.get("title"), "url": item.get("url"), "status": "pending"}
+    for key, entry in latest.items():
+        status[key] = {**status.get(key, {}), **entry}
+
+    _write_json_atomic(status_file, status)
+
+    counts = {}
+    for entry in status.values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    print(f"Status written to {status_file}: " + ", ".join(f"{v} {k}" for k, v in sorted(counts.items())))
+    return status
+
+
+def discard_results(results_dir, worker_id):
+    """
+    Removes a worker's results file once merge_results has copied it into the
+    status file. Only for workers that do not share the results directory
+    with running workers, i.e. outside --shard.
+    """
+    try:
+        os.remove(os.path.join(results_dir, f"{worker_id}.jsonl"))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,177 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from execution.block_manifest import BLOCK_SIZE, hash_file, is_manifest, load_manifest, save_manifest, write_manifest
+    from execution.file_integrity import PART_SUFFIX
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from block_manifest import BLOCK_SIZE, hash_file, is_manifest, load_manifest, save_manifest, write_manifest
+    from file_integrity import PART_SUFFIX
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+DOWNLOADS_DIR = os.path.join(OUTPUT_ROOT, "downloads")
+
+COPY_WORKERS = 4  # Files copied at once; block copies are I/O bound
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def archive_files(root):
+    """Paths (relative to `root`) of the archived files, without manifests and partial downloads."""
+    found = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if is_manifest(name) or name.endswith((PART_SUFFIX, ".tmp")):
+                continue
+            found.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(found)
+
+
+def _hash_worker(task):
+    rel, path = task
+    return rel, write_manifest(path)
+
+
+def ensure_manifests(root, paths, processes=None):
+    """
+    Manifests of the given files below `root`. Current manifests are read
+    as is; missing or stale ones are computed in parallel processes with
+    memory-mapped reads and written next to the files.
+    """
+    manifests = {}
+    stale = []
+    for rel in paths:
+        manifest = load_manifest(os.path.join(root, rel))
+        if manifest and manifest["block_size"] == BLOCK_SIZE:
+            manifests[rel] = manifest
+        else:
+            stale.append((rel, os.path.join(root, rel)))
+    if not stale:
+        return manifests
+
+    total = sum(os.path.getsize(path) for _, path in stale)
+    processes = processes or os.cpu_count() or 1
+    print(f"Hashing {len(stale)} files ({format_bytes(total)}) in {root} with {processes} processes...")
+    started = time.time()
+    # Largest first, so one big recording does not start last and hold up the pool
+    stale.sort(key=lambda task: os.path.getsize(task[1]), reverse=True)
+    with multiprocessing.Pool(processes) as pool:
+        for rel, manifest in pool.imap_unordered(_hash_worker, stale):
+            manifests[rel] = manifest
+    elapsed = max(time.time() - started, 1e-6)
+    print(f"Hashed {format_bytes(total)} in {elapsed:.1f}s ({format_bytes(total / elapsed)}/s).")
+    return manifests
+
+
+def changed_blocks(source_manifest, target_manifest):
+    """Indexes of the source blocks the target is missing or holds different data for."""
+    old = target_manifest["blocks"] if target_manifest else []
+    return [i for i, block in enumerate(source_manifest["blocks"]) if i >= len(old) or old[i] != block]
+
+
+def sync_file(source, target, source_manifest, target_manifest):
+    """
+    Brings `target` up to date with `source` by writing only the changed
+    blocks in place, then truncates it to the source size and records the
+    source manifest as the target's. Returns the bytes copied.
+    """
+    block_size = source_manifest["block_size"]
+    copied = 0
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(source, "rb") as src, open(target, "r+b" if os.path.exists(target) else "wb") as dst:
+        for i in changed_blocks(source_manifest, target_manifest):
+            src.seek(i * block_size)
+            data = src.read(block_size)
+            dst.seek(i * block_size)
+            dst.write(data)
+            copied += len(data)
+        dst.truncate(source_manifest["size"])
+        dst.flush()
+        os.fsync(dst.fileno())
+    shutil.copystat(source, target)
+    # The manifest is written last: after a crash the target looks stale and is hashed again
+    save_manifest(target, {**source_manifest, "mtime_ns": os.stat(target).st_mtime_ns})
+    return copied
+
+
+def replicate(source_root, target_root, processes=None, workers=COPY_WORKERS, dry_run=False, verify=False):
+    """
+    Mirrors `source_root` into `target_root` block by block. Files are
+    compared by manifest; only missing or changed blocks are copied. Files
+    that exist only in the target are left alone.
+    """
+    paths = archive_files(source_root)
+    source_manifests = ensure_manifests(source_root, paths, processes)
+    existing = [rel for rel in paths if os.path.isfile(os.path.join(target_root, rel))]
+    target_manifests = ensure_manifests(target_root, existing, processes)
+
+    plan = []
+    for rel in paths:
+        source_manifest, target_manifest = source_manifests[rel], target_manifests.get(rel)
+        if target_manifest and target_manifest["sha256"] == source_manifest["sha256"]:
+            continue
+        blocks = changed_blocks(source_manifest, target_manifest)
+        plan.append((rel, source_manifest, target_manifest, blocks))
+
+    total = sum(manifest["size"] for manifest in source_manifests.values())
+    to_copy = sum(min(len(blocks) * m["block_size"], m["size"]) for _, m, _, blocks in plan)
+    print(f"\n{len(paths)} files ({format_bytes(total)}): {len(paths) - len(plan)} up to date, "
+          f"{sum(1 for p in plan if p[2] is None)} new, {sum(1 for p in plan if p[2] is not None)} changed. "
+          f"About {format_bytes(to_copy)} to copy.")
+    if dry_run:
+        for rel, _, target_manifest, blocks in plan:
+            print(f"  {'new' if target_manifest is None else 'changed':<8} {len(blocks):>5} blocks  {rel}")
+        return
+
+    def copy(entry):
+        rel, source_manifest, target_manifest, _ = entry
+        target = os.path.join(target_root, rel)
+        copied = sync_file(os.path.join(source_root, rel), target, source_manifest, target_manifest)
+        if verify and hash_file(target, source_manifest["block_size"])["sha256"] != source_manifest["sha256"]:
+            print(f"  [VERIFY] {rel}: target does not match the source after copying")
+        return copied
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        copied = sum(pool.map(copy, plan))
+    print(f"Copied {format_bytes(copied)} of {format_bytes(total)} in {time.time() - started:.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block-hash manifests and incremental replication of the downloads/ archive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    hashing = commands.add_parser("hash", help="Write missing or stale manifests for an existing archive.")
+    hashing.add_argument("root", nargs="?", default=DOWNLOADS_DIR, help="Archive directory (default: downloads/).")
+    hashing.add_argument("--processes", type=int, help="Hashing processes (default: one per CPU).")
+
+    sync = commands.add_parser("sync", help="Copy missing or changed blocks to a local or mounted replica.")
+    sync.add_argument("target", help="Replica directory, e.g. /mnt/backup1/downloads.")
+    sync.add_argument("--source", default=DOWNLOADS_DIR, help="Archive directory (default: downloads/).")
+    sync.add_argument("--processes", type=int, help="Hashing processes for files without current manifests (default: one per CPU).")
+    sync.add_argument("--workers", type=int, default=COPY_WORKERS, help="Files copied at once (default: 4).")
+    sync.add_argument("--dry-run", action="store_true", help="Only show what would be copied.")
+    sync.add_argument("--verify", action="store_true", help="Re-hash every updated target file and compare it with the source.")
+    args = parser.parse_args()
+
+    if args.command == "hash":
+        manifests = ensure_manifests(args.root, archive_files(args.root), args.processes)
+        print(f"{len(manifests)} files have current manifests.")
+    else:
+        replicate(args.source, args.target, args.processes, args.workers, args.dry_run, args.verify)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import os
+import random
+import socket
+import time
+
+import requests
+from selenium.common.exceptions import TimeoutException
+
+try:
+    from execution.queue_lease import item_key
+    from execution.tenant_config import OUTPUT_ROOT
+except ImportError:
+    from queue_lease import item_key
+    from tenant_config import OUTPUT_ROOT
+
+# Output Root Setup
+RETRY_QUEUE_FILE = os.path.join(OUTPUT_ROOT, "retry_queue.json")
+
+# Error classes
+SESSION_EXPIRED = "session_expired"
+SEGMENT_NOT_FOUND = "segment_not_found"
+THROTTLED = "throttled"
+HTTP_4XX = "http_4xx"
+HTTP_5XX = "http_5xx"
+TIMEOUT = "timeout"
+UNKNOWN = "unknown"
+
+# attempts: total tries within one run (including the first)
+# base_delay / max_delay: seconds, for exponential backoff with full jitter
+# refresh_session: re-validate the Brightspace session before the next try
+RETRY_POLICIES = {
+    SESSION_EXPIRED: {"attempts": 3, "base_delay": 1, "max_delay": 10, "refresh_session": True},
+    # The player sometimes starts late; one more page load usually finds the segment.
+    SEGMENT_NOT_FOUND: {"attempts": 2, "base_delay": 5, "max_delay": 30},
+    THROTTLED: {"attempts": 5, "base_delay": 30, "max_delay": 300},
+    # 404/410 and friends will not fix themselves within this run.
+    HTTP_4XX: {"attempts": 1, "base_delay": 0, "max_delay": 0},
+    HTTP_5XX: {"attempts": 4, "base_delay": 10, "max_delay": 120},
+    TIMEOUT: {"attempts": 4, "base_delay": 5, "max_delay": 60},
+    UNKNOWN: {"attempts": 2, "base_delay": 5, "max_delay": 30},
+}
+
+
+class SessionExpiredError(Exception):
+    """The Brightspace session ran out (login page or 401/403)."""
+
+
+class SegmentNotFoundError(Exception):
+    """No Kaltura segment URL appeared in the network traffic of a video page."""
+
+
+def classify_error(exc):
+    """Maps an exception raised while processing a queue item to an error class."""
+    if isinstance(exc, SessionExpiredError):
+        return SESSION_EXPIRED
+    if isinstance(exc, SegmentNotFoundError):
+        return SEGMENT_NOT_FOUND
+    code = None
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        code = exc.response.status_code
+    elif isinstance(getattr(exc, "status", None), int):
+        code = exc.status  # aiohttp.ClientResponseError (async transfer engine)
+    if code is not None:
+        if code in (401, 403):
+            return SESSION_EXPIRED
+        if code == 429:
+            return THROTTLED
+        if 400 <= code < 500:
+            return HTTP_4XX
+        if code >= 500:
+            return HTTP_5XX
+    if isinstance(exc, (requests.Timeout, requests.ConnectionError, socket.timeout, TimeoutException, TimeoutError, ConnectionError)):
+        return TIMEOUT
+    # aiohttp connection errors (async transfer engine), matched by name so
+    # this module does not depend on aiohttp
+    if any(cls.__name__ == "ClientConnectionError" for cls in type(exc).__mro__):
+        return TIMEOUT
+    return UNKNOWN
+
+
+def backoff_delay(error_class, attempt):
+    """Exponential backoff with full jitter for the given (1-based) failed attempt."""
+    policy = RETRY_POLICIES[error_class]
+    cap = min(policy["max_delay"], policy["base_delay"] * (2 ** (attempt - 1)))
+    return random.uniform(0, cap)
+
+
+def should_retry(error_class, attempt):
+    return attempt < RETRY_POLICIES[error_class]["attempts"]
+
+
+def load_retry_queue(path=RETRY_QUEUE_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_retry_queue(status, queue, path=RETRY_QUEUE_FILE):
+    """
+    Writes every queue item whose latest result is a failure (or that was
+    postponed by pre-flight admission) to the retry queue,
+    together with its error class and attempt count. The next run processes
+    these items first.
+    """
+    items = []
+    for item in queue:
+        entry = status.get(item_key(item))
+        if not entry or entry.get("status") not in ("failed", "postponed"):
+            continue
+        clean_item = {k: v for k, v in item.items() if k != "retry"}
+        clean_item["retry"] = {
+            "error_class": entry.get("error_class", UNKNOWN),
+            "error": entry.get("error"),
+            "attempts": (item.get("retry") or {}).get("attempts", 0) + entry.get("attempts", 1),
+            "failed_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry.get("finished", time.time()))),
+        }
+        items.append(clean_item)
+
+    # Sharded workers each write the merged view when they finish; a private
+    # temp name keeps their writes from interleaving.
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(items, f, indent=2)
+    os.replace(tmp_path, path)
+    if items:
+        print(f"{len(items)} failed items saved to {path} for the next run.")
+    return items
@@ -0,0 +1,115 @@
+import re
+import statistics
+from collections import deque
+
+try:
+    from execution.preflight import item_course
+except ImportError:
+    from preflight import item_course
+
+# Bytes of credit a course of weight 1 gets per round. Items larger than this
+# wait a few rounds while other courses' smaller items go ahead.
+DEFAULT_QUANTUM_MB = 256
+# Size estimates for items whose size is not known yet (no pre-flight, no HEAD)
+DEFAULT_SIZE_ESTIMATES = {"video": 300 * 1024 ** 2, "pdf": 2 * 1024 ** 2}
+
+TOPIC_ID_PATTERN = re.compile(r"/viewContent/(\d+)")
+
+
+def parse_weights(specs):
+    """['CS 101=3', 'MA 261=0.5'] -> {'CS 101': 3.0, 'MA 261': 0.5}"""
+    weights = {}
+    for spec in specs or []:
+        name, _, weight = spec.rpartition("=")
+        if not name:
+            raise ValueError(f"Expected COURSE=WEIGHT, got '{spec}'")
+        weights[name] = float(weight)
+    return weights
+
+
+def topic_id(item):
+    """Brightspace topic ID from the viewContent URL. IDs grow with creation time, so newer topics sort higher."""
+    match = TOPIC_ID_PATTERN.search(item.get("url") or "")
+    return int(match.group(1)) if match else 0
+
+
+def size_estimates(items):
+    """Median known size per item type, falling back to DEFAULT_SIZE_ESTIMATES."""
+    estimates = dict(DEFAULT_SIZE_ESTIMATES)
+    by_type = {}
+    for item in items:
+        if item.get("size"):
+            by_type.setdefault(item.get("type", "video"), []).append(item["size"])
+    for item_type, sizes in by_type.items():
+        estimates[item_type] = statistics.median(sizes)
+    return estimates
+
+
+def course_order(items, type_priority, newest_first, estimates):
+    """
+    Order within one course: by type priority, then newest first (if asked),
+    then smallest first, so short clips and PDFs are not stuck behind long
+    recordings.
+    """
+    def key(item):
+        item_type = item.get("type", "video")
+        rank = type_priority.index(item_type) if item_type in type_priority else len(type_priority)
+        size = item.get("size") or estimates.get(item_type, 0)
+        return (rank, -topic_id(item) if newest_first else 0, size)
+    return sorted(items, key=key)
+
+
+def fair_order(items, weights=None, type_priority=(), newest_first=False, quantum_mb=DEFAULT_QUANTUM_MB):
+    """
+    Orders items by deficit round robin across courses: each round a course
+    earns `quantum * weight` bytes of credit and sends its next items while
+    they fit. Small items of every course therefore flow early, large ones
+    are spread over the run, and throughput is shared by course weight.
+    Items from the retry queue (marked with "retry") stay in front.
+    """
+    weights = weights or {}
+    type_priority = list(type_priority)
+    estimates = size_estimates(items)
+    quantum = quantum_mb * 1024 ** 2
+
+    retries = [item for item in items if "retry" in item]
+    courses = {}
+    for item in items:
+        if "retry" not in item:
+            courses.setdefault(item_course(item), []).append(item)
+
+    pending = {
+        course: deque(course_order(course_items, type_priority, newest_first, estimates))
+        for course, course_items in courses.items()
+        if weights.get(course, 1) > 0
+    }
+    # Weight 0 parks a course until everything else is scheduled
+    parked = [
+        item
+        for course, course_items in courses.items() if weights.get(course, 1) <= 0
+        for item in course_order(course_items, type_priority, newest_first, estimates)
+    ]
+
+    ordered = list(retries)
+    deficit = {course: 0 for course in pending}
+    while pending:
+        for course in list(pending):
+            queue = pending[course]
+            deficit[course] += quantum * weights.get(course, 1)
+            while queue:
+                size = queue[0].get("size") or estimates.get(queue[0].get("type", "video"), 0)
+                if size > deficit[course]:
+                    break
+                deficit[course] -= size
+                ordered.append(queue.popleft())
+            if not queue:
+                del pending[course]
+    return ordered + parked
+
+
+def print_schedule(items, limit=15):
+    print(f"\n[SCHEDULE] First {min(limit, len(items))} of {len(items)} items:")
+    for item in items[:limit]:
+        size = item.get("size")
+        size_text = f"{size / 1024 ** 2:.1f} MB" if size else "size unknown"
+        print(f"  {item_course(item)[:30]:<30} {item.get('type', 'video'):<6} {size_text:>14}  {item.get('title')}")
@@ -0,0 +1,87 @@
+import os
+import threading
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+
+# Project Root Setup
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Where queues, reports, status files and downloads are written. The
+# multi-account orchestrator gives every account its own output root.
+OUTPUT_ROOT = os.path.abspath(os.getenv("D2L_OUTPUT_ROOT") or PROJECT_ROOT)
+
+# Account settings and session cookies (one file per account)
+ENV_FILE = os.path.abspath(os.getenv("D2L_ENV_FILE") or os.path.join(PROJECT_ROOT, ".env", ".env"))
+
+# Set by multi_account.py for its subprocesses: nobody can log in by hand, so
+# a failed auto-login ends the process with LOGIN_REQUIRED_EXIT.
+NONINTERACTIVE_ENV = "D2L_NONINTERACTIVE"
+LOGIN_REQUIRED_EXIT = 3
+
+# Defaults are Purdue's tenant; every value can be overridden in the env file.
+DEFAULT_BASE_URL = "https://purdue.brightspace.com"
+# cookie name -> env variable holding its value
+DEFAULT_SESSION_COOKIES = "d2lSecureSessionVal=D2L_SECURE_SESSION_VAL,d2lSessionVal=D2L_SESSION_VAL"
+DEFAULT_CANARY_COOKIES = "d2lSameSiteCanaryA,d2lSameSiteCanaryB"
+# CSS selectors of the IdP link on the Brightspace login page, tried in order.
+# Separated by "|" because selectors may contain commas.
+DEFAULT_IDP_LINK_SELECTORS = "a[title*='Purdue West Lafayette']|a[href*='idp.purdue.edu']"
+
+# The env file is parsed again only when it changed on disk (fresh cookies
+# saved by a session refresh, possibly in another process).
+_env_lock = threading.Lock()
+_env_mtime = None
+_tenant = None
+
+
+def _env_file_mtime():
+    try:
+        return os.stat(ENV_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_env():
+    """Loads the account's env file into os.environ if it changed since the last load."""
+    global _env_mtime, _tenant
+    with _env_lock:
+        mtime = _env_file_mtime()
+        if _tenant is not None and mtime == _env_mtime:
+            return
+        load_dotenv(dotenv_path=ENV_FILE, override=True)
+        _env_mtime = mtime
+        _tenant = _read_tenant()
+
+
+def get_tenant():
+    """
+    Returns the tenant settings (base URL, cookies, login flow) for this
+    process, read from the env file with Purdue defaults.
+    """
+    load_env()
+    return _tenant
+
+
+def _read_tenant():
+    base_url = (os.getenv("D2L_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+    host = urlparse(base_url).hostname
+
+    session_cookies = {}
+    for pair in (os.getenv("D2L_SESSION_COOKIES") or DEFAULT_SESSION_COOKIES).split(","):
+        name, _, env_var = pair.strip().partition("=")
+        if name and env_var:
+            session_cookies[name] = env_var
+
+    return {
+        "base_url": base_url,
+        "host": host,
+        "home_url": f"{base_url}/d2l/home",
+        "cookie_domain": os.getenv("D2L_COOKIE_DOMAIN") or f".{host}",
+        "session_cookies": session_cookies,
+        "canary_cookies": [c.strip() for c in (os.getenv("D2L_CANARY_COOKIES") or DEFAULT_CANARY_COOKIES).split(",") if c.strip()],
+        "idp_link_selectors": [s.strip() for s in (os.getenv("D2L_IDP_LINK_SELECTORS") or DEFAULT_IDP_LINK_SELECTORS).split("|") if s.strip()],
+        "username_field_id": os.getenv("D2L_USERNAME_FIELD_ID") or "username",
+        "password_field_id": os.getenv("D2L_PASSWORD_FIELD_ID") or "password",
+        "submit_button_name": os.getenv("D2L_SUBMIT_BUTTON_NAME") or "_eventId_proceed",
+    }
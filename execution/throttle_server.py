@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+try:
+    from execution.async_downloader import download_all
+    from execution.concurrency_controller import AIMDController
+    from execution.preflight import probe_sizes
+    from execution.retry_policy import RETRY_POLICIES
+except ImportError:
+    from async_downloader import download_all
+    from concurrency_controller import AIMDController
+    from preflight import probe_sizes
+    from retry_policy import RETRY_POLICIES
+
+# Local stand-in for Brightspace/Kaltura file serving with a hidden capacity.
+# Up to CAPACITY requests are served normally; beyond it latency climbs and
+# requests are answered with 429, 503 or a redirect to the login page, the
+# same signals the real servers send when they throttle.
+DEFAULT_CAPACITY = 12
+DEFAULT_BANDWIDTH_MB = 40  # Shared by all transfers in progress
+DEFAULT_LATENCY = 0.05  # Seconds before the first byte when not overloaded
+DEFAULT_FILE_KB = 256
+DEFAULT_FILES = 300
+CHUNK_SIZE = 64 * 1024
+LOGIN_PATH = "/d2l/login"
+FILE_PATTERN = re.compile(r"^/files/(\d+)\.pdf$")
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-")
+# How overload is answered (relative weights)
+THROTTLE_RESPONSES = [(429, 5), (503, 3), (302, 2)]
+
+
+def pdf_body(file_id, size):
+    """Deterministic PDF-looking body of `size` bytes that passes file_integrity checks."""
+    header = f"%PDF-1.4\n% test file {file_id}\n".encode()
+    trailer = b"\n%%EOF\n"
+    filler = size - len(header) - len(trailer)
+    return header + bytes((file_id + i) % 251 for i in range(256)) * (filler // 256) + b" " * (filler % 256) + trailer
+
+
+def make_handler(capacity, bandwidth, latency, file_size, stats):
+    lock = threading.Lock()
+    bodies = {}
+
+    class ThrottlingHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _enter(self):
+            with lock:
+                stats["active"] += 1
+                stats["peak"] = max(stats["peak"], stats["active"])
+                return stats["active"]
+
+        def _leave(self):
+            with lock:
+                stats["active"] -= 1
+
+        def _count(self, status):
+            with lock:
+                stats["requests"] += 1
+                stats[status] = stats.get(status, 0) + 1
+
+        def _throttle(self, active):
+            """Answers an overloaded request with a throttling signal. Returns True if it did."""
+            overload = (active - capacity) / capacity
+            if overload <= 0 or random.random() > min(1.0, overload * 2):
+                return False
+            status = random.choices(*zip(*THROTTLE_RESPONSES))[0]
+            self._count(status)
+            self.send_response(status)
+            if status == 302:
+                self.send_header("Location", LOGIN_PATH)
+            else:
+                self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+
+        def _serve(self, send_body):
+            if self.path.startswith(LOGIN_PATH):
+                body = b"<html><body>Log in</body></html>"
+                self._count(200)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(body)
+                return
+            match = FILE_PATTERN.match(self.path)
+            if not match:
+                self._count(404)
+                self.send_error(404)
+                return
+
+            active = self._enter()
+            try:
+                # Queueing delay grows with the square of the overload
+                time.sleep(latency * max(1.0, active / capacity) ** 2)
+                if self._throttle(active):
+                    return
+                file_id = int(match.group(1))
+                if file_id not in bodies:
+                    bodies[file_id] = pdf_body(file_id, file_size)
+                body = bodies[file_id]
+
+                range_match = RANGE_PATTERN.match(self.headers.get("Range", ""))
+                offset = int(range_match.group(1)) if range_match else 0
+                if offset >= len(body):
+                    self._count(416)
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(body)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206 if range_match else 200
+                self._count(status)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(len(body) - offset))
+                if range_match:
+                    self.send_header("Content-Range", f"bytes {offset}-{len(body) - 1}/{len(body)}")
+                self.end_headers()
+                if not send_body:
+                    return
+                for start in range(offset, len(body), CHUNK_SIZE):
+                    chunk = body[start:start + CHUNK_SIZE]
+                    self.wfile.write(chunk)
+                    # Transfers in progress share the bandwidth
+                    time.sleep(len(chunk) / (bandwidth / max(1, stats["active"])))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                self._leave()
+
+        def do_GET(self):
+            self._serve(True)
+
+        def do_HEAD(self):
+            self._serve(False)
+
+    return ThrottlingHandler
+
+
+def start_server(capacity=DEFAULT_CAPACITY, bandwidth_mb=DEFAULT_BANDWIDTH_MB, latency=DEFAULT_LATENCY, file_kb=DEFAULT_FILE_KB, port=0):
+    """Starts the stand-in server in a background thread. Returns (server, base URL, stats)."""
+    stats = {"active": 0, "peak": 0, "requests": 0}
+    handler = make_handler(capacity, bandwidth_mb * 1024 * 1024, latency, file_kb * 1024, stats)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+
+def scale_backoff(factor):
+    """Shortens every retry delay so a demo run takes seconds instead of minutes."""
+    for policy in RETRY_POLICIES.values():
+        policy["base_delay"] *= factor
+        policy["max_delay"] *= factor
+
+
+def print_server_stats(stats):
+    codes = {k: v for k, v in stats.items() if isinstance(k, int)}
+    print(f"[SERVER] {stats['requests']} requests, peak {stats['peak']} concurrent, responses: "
+          + ", ".join(f"{code}={count}" for code, count in sorted(codes.items())))
+
+
+def print_limit_timeline(controller, started):
+    print(f"[AIMD {controller.name}] limit over time:")
+    for decision in controller.decisions:
+        if decision["event"] != "hold":
+            print(f"  {decision['time'] - started:6.1f}s  {decision['event']:<8} -> {decision['limit']:>3}  ({decision['reason']})")
+
+
+def demo_transfer(base_url, args, controller):
+    target_dir = tempfile.mkdtemp(prefix="throttle-demo-")
+    jobs = [
+        {"media_url": f"{base_url}/files/{i}.pdf", "filename": os.path.join(target_dir, f"{i}.pdf"), "title": f"File {i}"}
+        for i in range(args.files)
+    ]
+    failed = []
+
+    def on_done(job, path, error, error_class, attempts, seconds):
+        if error:
+            failed.append((job["title"], error_class))
+
+    try:
+        asyncio.run(download_all(jobs, None, args.max_in_flight, None, on_done, controller))
+    finally:
+        shutil.rmtree(target_dir, ignore_errors=True)
+    return len(jobs) - len(failed), len(failed)
+
+
+def demo_probe(base_url, args, controller):
+    items = [{"media_url": f"{base_url}/files/{i}.pdf", "size": None} for i in range(args.files)]
+    probe_sizes(requests.Session(), items, workers=args.max_in_flight, controller=controller)
+    known = sum(1 for item in items if item["size"])
+    return known, len(items) - known
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local file server that throttles like Brightspace under load, for testing adaptive concurrency.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to serve on without --demo (default: 8765).")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="Concurrent requests served before throttling starts (default: 12).")
+    parser.add_argument("--bandwidth-mb", type=float, default=DEFAULT_BANDWIDTH_MB, help="MB/s shared by all transfers (default: 40).")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Seconds to first byte below capacity (default: 0.05).")
+    parser.add_argument("--file-kb", type=int, default=DEFAULT_FILE_KB, help="Size of each served file (default: 256).")
+    parser.add_argument("--demo", choices=["transfer", "probe"], help="Run the async transfer engine or the size probe against the server and print the controller's decisions.")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES, help="Files to fetch in --demo (default: 300).")
+    parser.add_argument("--fixed", action="store_true", help="In --demo, use --max-in-flight fixed workers instead of the AIMD controller (for comparison).")
+    parser.add_argument("--initial", type=int, default=4, help="Starting limit of the controller (default: 4).")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Ceiling of the controller, or the fixed worker count (default: 64).")
+    parser.add_argument("--backoff-scale", type=float, default=0.02, help="Factor applied to retry delays in --demo (default: 0.02).")
+    parser.add_argument("--metrics-file", help="Also append the controller's decisions to this JSONL file.")
+    args = parser.parse_args()
+
+    if not args.demo:
+        server, base_url, _ = start_server(args.capacity, args.bandwidth_mb, args.latency, args.file_kb, args.port)
+        print(f"Serving {base_url}/files/<n>.pdf (capacity {args.capacity}). Ctrl+C to stop.")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    server, base_url, stats = start_server(args.capacity, args.bandwidth_mb, args.latency, args.file_kb)
+    scale_backoff(args.backoff_scale)
+    controller = None
+    if not args.fixed:
+        controller = AIMDController(args.demo, initial=args.initial, maximum=args.max_in_flight, metrics_file=args.metrics_file)
+
+    started = time.time()
+    ok, failed = (demo_transfer if args.demo == "transfer" else demo_probe)(base_url, args, controller)
+    elapsed = time.time() - started
+    server.shutdown()
+
+    mode = f"fixed {args.max_in_flight}" if args.fixed else f"AIMD {args.initial}-{args.max_in_flight}"
+    print(f"\n[DEMO] {args.demo} with {mode} against capacity {args.capacity}: "
+          f"{ok} ok, {failed} failed in {elapsed:.1f}s")
+    print_server_stats(stats)
+    if controller is not None:
+        print_limit_timeline(controller, started)
+        controller.print_summary()
+
+
+if __name__ == "__main__":
+    main()
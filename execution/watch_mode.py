@@ -0,0 +1,375 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import socket
+import threading
+import time
+
+import requests
+
+try:
+    from execution.archive_catalog import record_discovered
+    from execution.batch_downloader import QUEUE_FILE, refresh_session, run_item
+    from execution.brightspace_parser import dedupe_queue, find_pinned_courses, open_homepage, scan_course
+    from execution.content_classifier import save_cache
+    from execution.driver_utils import is_login_page, load_brightspace_cookies, setup_driver, validate_and_refresh_session
+    from execution.kaltura_video_extractor import le_api_version, make_session
+    from execution.queue_lease import (
+        RESULTS_DIR,
+        STATUS_FILE,
+        default_worker_id,
+        discard_results,
+        item_key,
+        load_results,
+        merge_results,
+    )
+    from execution.retry_policy import SessionExpiredError, save_retry_queue
+    from execution.tenant_config import OUTPUT_ROOT, get_tenant
+except ImportError:
+    from archive_catalog import record_discovered
+    from batch_downloader import QUEUE_FILE, refresh_session, run_item
+    from brightspace_parser import dedupe_queue, find_pinned_courses, open_homepage, scan_course
+    from content_classifier import save_cache
+    from driver_utils import is_login_page, load_brightspace_cookies, setup_driver, validate_and_refresh_session
+    from kaltura_video_extractor import le_api_version, make_session
+    from queue_lease import (
+        RESULTS_DIR,
+        STATUS_FILE,
+        default_worker_id,
+        discard_results,
+        item_key,
+        load_results,
+        merge_results,
+    )
+    from retry_policy import SessionExpiredError, save_retry_queue
+    from tenant_config import OUTPUT_ROOT, get_tenant
+
+# Output Root Setup
+WATCH_STATE_FILE = os.path.join(OUTPUT_ROOT, "watch_state.json")
+
+DEFAULT_POLL_INTERVAL = 300  # Seconds between change checks of one course
+DEFAULT_JITTER = 0.2  # +/- fraction of the interval, so courses are not polled in lockstep
+DEFAULT_WORKERS = 2  # Download workers, each with its own headless browser
+COURSE_LIST_REFRESH = 3600  # Re-read the pinned courses this often
+# Without a usable fingerprint a course is fully rescanned at most this often
+FALLBACK_SCAN_INTERVAL = 6 * 3600
+WORKER_STOP_TIMEOUT = 30  # Seconds to wait for workers after Ctrl+C before closing their browsers
+
+ORG_UNIT_PATTERN = re.compile(r"/d2l/home/(\d+)")
+VIEW_CONTENT_ID_PATTERN = re.compile(r"/viewContent/(\d+)")
+
+
+def course_org_unit(course_url):
+    match = ORG_UNIT_PATTERN.search(course_url or "")
+    return match.group(1) if match else None
+
+
+def _check_response(r):
+    if r.status_code in (401, 403) or is_login_page(r.url):
+        raise SessionExpiredError(f"Change check redirected to {r.url} ({r.status_code})")
+
+
+def _toc_topics(modules):
+    for module in modules or []:
+        for topic in module.get("Topics") or []:
+            yield topic
+        yield from _toc_topics(module.get("Modules"))
+
+
+def course_fingerprint(session, base_url, api_version, course_url):
+    """
+    Cheap change check: a hash over the course's topic IDs and modification
+    dates, read with one JSON request to the content TOC API. Falls back to
+    the topic IDs linked from the Table of Contents page HTML. Returns None
+    if neither works.
+    """
+    org_unit = course_org_unit(course_url)
+    if not org_unit:
+        return None
+
+    if api_version:
+        try:
+            r = session.get(f"{base_url}/d2l/api/le/{api_version}/{org_unit}/content/toc", timeout=30)
+            _check_response(r)
+            if r.ok:
+                topics = sorted(
+                    f"{topic.get('TopicId')}:{topic.get('LastModifiedDate')}"
+                    for topic in _toc_topics(r.json().get("Modules"))
+                )
+                return "api:" + hashlib.sha1("\n".join(topics).encode("utf-8")).hexdigest()
+        except (requests.RequestException, ValueError):
+            pass
+
+    try:
+        r = session.get(f"{base_url}/d2l/le/content/{org_unit}/Home?itemIdentifier=TOC", timeout=30)
+        _check_response(r)
+        if r.ok:
+            topic_ids = sorted(set(VIEW_CONTENT_ID_PATTERN.findall(r.text)))
+            if topic_ids:
+                return "html:" + hashlib.sha1(",".join(topic_ids).encode("utf-8")).hexdigest()
+    except requests.RequestException:
+        pass
+    return None
+
+
+def next_poll(interval, jitter):
+    return time.time() + interval * random.uniform(1 - jitter, 1 + jitter)
+
+
+def load_state(path=WATCH_STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    # Private temp file per writer: two writers sharing one would rename each other's half-written data
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_queue():
+    if not os.path.exists(QUEUE_FILE):
+        return []
+    with open(QUEUE_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def download_worker(work, worker_id, results_dir, stop, drivers):
+    """
+    Downloads items from `work` with its own headless browser until it
+    receives None or `stop` is set. The current browser is kept in
+    `drivers[worker_id]` so it can be closed on shutdown.
+    """
+    driver = drivers[worker_id] = setup_driver(headless=True)
+    try:
+        load_brightspace_cookies(driver)
+        driver = drivers[worker_id] = validate_and_refresh_session(driver)
+        while not stop.is_set():
+            item = work.get()
+            if item is None or stop.is_set():
+                break
+            try:
+                driver, status = run_item(driver, item, f"[WATCH {worker_id}]", worker_id, results_dir)
+            except Exception as e:
+                print(f"[WATCH {worker_id}] Error processing {item.get('title')}: {e}")
+            drivers[worker_id] = driver
+    finally:
+        # Already closed by stop_workers if it gave up waiting
+        if drivers.pop(worker_id, None) is not None:
+            driver.quit()
+
+
+def connect(driver, tenant):
+    """
+    Opens the scanner browser (or re-validates its session) and returns
+    (driver, requests session, LE API version).
+    """
+    if driver is None:
+        driver = open_homepage(setup_driver(headless=True), {})
+    else:
+        driver = refresh_session(driver)
+    session = make_session(driver)
+    api_version = le_api_version(session, tenant["base_url"])
+    print(f"[WATCH] Change checks use {'LE API ' + api_version if api_version else 'the TOC page'}.")
+    return driver, session, api_version
+
+
+def has_changed(entry, fingerprint):
+    """
+    True if the course changed since the last check (or has no fingerprint
+    and was not scanned for a while). The new fingerprint is not stored
+    here: that happens only once the rescan succeeded.
+    """
+    entry["checked"] = time.time()
+    if fingerprint is None:
+        return time.time() - entry.get("scanned", 0) > FALLBACK_SCAN_INTERVAL
+    return fingerprint != entry.get("fingerprint")
+
+
+def rescan(driver, course_url, entry, queue_items, known, work, use_toc):
+    """
+    Rescans one course and pushes items not seen before to the download
+    workers. Returns False if the scan found nothing (e.g. it timed out),
+    so the course is rescanned on the next poll.
+    """
+    found = []
+    title = scan_course(driver, course_url, found, use_toc, report_file=os.devnull)
+    save_cache()
+    if not found:
+        print(f"[WATCH] {title or course_url}: rescan found no videos or PDFs, trying again on the next poll.")
+        return False
+    entry["scanned"] = time.time()
+    entry["title"] = title
+
+    found = dedupe_queue(found)
+    record_discovered(found)
+    new_items = [item for item in found if item_key(item) not in known]
+    if not new_items:
+        print(f"[WATCH] {title}: changed, but no new videos or PDFs.")
+        return True
+    print(f"[WATCH] {title}: {len(new_items)} new items.")
+    for item in new_items:
+        print(f"  + {item['title']}")
+        known.add(item_key(item))
+        queue_items.append(item)
+        work.put(item)
+    # Keep download_queue.json complete for batch_downloader runs
+    save_json(QUEUE_FILE, queue_items)
+    return True
+
+
+def check_course(driver, session, api_version, tenant, course_url, entry, queue_items, known, work, use_toc):
+    """
+    Change check of one course, rescanning it if it changed. The fingerprint
+    is recorded only after a successful rescan; if the rescan raises or finds
+    nothing, the next poll sees the change again. Returns (driver, session,
+    api_version), which a session refresh may have replaced.
+    """
+    try:
+        fingerprint = course_fingerprint(session, tenant["base_url"], api_version, course_url)
+    except SessionExpiredError as e:
+        print(f"[WATCH] {e}. Refreshing session...")
+        driver, session, api_version = connect(driver, tenant)
+        fingerprint = course_fingerprint(session, tenant["base_url"], api_version, course_url)
+    if has_changed(entry, fingerprint) and rescan(driver, course_url, entry, queue_items, known, work, use_toc):
+        if fingerprint is not None:
+            entry["fingerprint"] = fingerprint
+    return driver, session, api_version
+
+
+def worker_name(args, i):
+    return f"{args.worker_id}-w{i+1}"
+
+
+def start_workers(work, args, stop, drivers):
+    workers = []
+    for i in range(args.workers):
+        worker = threading.Thread(
+            target=download_worker,
+            args=(work, worker_name(args, i), args.results_dir, stop, drivers),
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
+
+
+def stop_workers(workers, work, stop, drivers, wait):
+    """
+    Tells the download workers to stop. With `wait` they finish the queued
+    items first; otherwise they stop after their current item and, if still
+    busy after WORKER_STOP_TIMEOUT, their browsers are closed.
+    """
+    if not wait:
+        stop.set()
+    for _ in workers:
+        work.put(None)
+    deadline = time.time() + WORKER_STOP_TIMEOUT
+    for worker in workers:
+        worker.join(None if wait else max(0, deadline - time.time()))
+    for worker_id in list(drivers):
+        driver = drivers.pop(worker_id, None)
+        if driver is None:
+            continue
+        print(f"[WATCH {worker_id}] Still busy, closing its browser.")
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+
+def watch(args):
+    """
+    Polls every pinned course on its own jittered schedule with a cheap change
+    check. Only changed courses are rescanned in the browser; their new items
+    go straight to the download workers. One authenticated scanner session is
+    kept for the whole run.
+    """
+    tenant = get_tenant()
+    state = load_state()
+    queue_items = load_queue()
+    known = {item_key(item) for item in queue_items}
+    work = queue.Queue()
+    stop = threading.Event()
+    drivers = {}
+
+    if args.drain_queue:
+        results = load_results(args.results_dir)
+        pending = [item for item in queue_items if results.get(item_key(item), {}).get("status") != "done"]
+        print(f"[WATCH] Queueing {len(pending)} items from {QUEUE_FILE} that are not done yet.")
+        for item in pending:
+            work.put(item)
+    workers = start_workers(work, args, stop, drivers)
+
+    driver = None
+    courses = []
+    courses_loaded = 0
+    try:
+        driver, session, api_version = connect(driver, tenant)
+        while True:
+            if time.time() - courses_loaded > COURSE_LIST_REFRESH:
+                driver.get(tenant["base_url"] + "/")
+                pinned = find_pinned_courses(driver, {})
+                if pinned is not None:
+                    courses = sorted(pinned)
+                courses_loaded = time.time()
+                for course_url in courses:
+                    # New courses are checked right away, known ones keep their schedule
+                    state.setdefault(course_url, {"next_poll": time.time()})
+                print(f"[WATCH] Watching {len(courses)} pinned courses.")
+
+            for course_url in courses:
+                entry = state[course_url]
+                if entry.get("next_poll", 0) > time.time():
+                    continue
+                try:
+                    driver, session, api_version = check_course(
+                        driver, session, api_version, tenant, course_url, entry, queue_items, known, work, not args.click_modules
+                    )
+                except Exception as e:
+                    print(f"[WATCH] Error checking {course_url}: {e}")
+                entry["next_poll"] = next_poll(args.interval, args.jitter)
+            save_json(WATCH_STATE_FILE, state)
+
+            if args.once:
+                break
+            wake = min([state[c]["next_poll"] for c in courses] + [courses_loaded + COURSE_LIST_REFRESH])
+            time.sleep(max(1, wake - time.time()))
+    except KeyboardInterrupt:
+        print("\n[WATCH] Stopping...")
+    finally:
+        # A single pass (--once) finishes the downloads it found
+        stop_workers(workers, work, stop, drivers, wait=args.once)
+        if driver is not None:
+            driver.quit()
+        status = merge_results(args.results_dir, STATUS_FILE, queue_items)
+        for i in range(args.workers):
+            discard_results(args.results_dir, worker_name(args, i))
+        save_retry_queue(status, queue_items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch pinned courses and download new content as soon as it is posted.")
+    parser.add_argument("--interval", type=int, default=DEFAULT_POLL_INTERVAL, help="Seconds between change checks of each course (default: 300).")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER, help="Random +/- fraction applied to each interval (default: 0.2).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Download workers, each with its own headless browser (default: 2).")
+    parser.add_argument("--worker-id", default=default_worker_id(), help="Prefix of the download workers' result files.")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Directory for per-worker result files.")
+    parser.add_argument("--drain-queue", action="store_true", help="Also download items already in download_queue.json that are not done.")
+    parser.add_argument("--click-modules", action="store_true", help="Rescan changed courses by clicking through modules instead of the Table of Contents view.")
+    parser.add_argument("--once", action="store_true", help="Check every course once, download what is new and exit (e.g. from cron).")
+    args = parser.parse_args()
+
+    watch(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import threading
+import time
+
+# Set PROFILE_WEBDRIVER=1 (or pass --profile-webdriver) to profile every
+# WebDriver command sent by drivers created through setup_driver.
+PROFILE_ENV_VAR = "PROFILE_WEBDRIVER"
+
+# Frames from these packages are skipped when looking for the call site
+_LIBRARY_MARKERS = (
+    os.sep + "selenium" + os.sep,
+    os.sep + "seleniumwire" + os.sep,
+    os.sep + "undetected_chromedriver" + os.sep,
+    os.path.abspath(__file__),
+)
+
+_enabled = False
+_lock = threading.Lock()
+# (command, call site) -> [count, total seconds, max seconds]
+_stats = {}
+
+
+def enable_profiling():
+    global _enabled
+    _enabled = True
+
+
+def profiling_enabled():
+    return _enabled or os.getenv(PROFILE_ENV_VAR, "").lower() in ("1", "true", "yes")
+
+
+def _call_site():
+    """First frame outside Selenium and this module, as 'file.py:line (function)'."""
+    frame = sys._getframe(2)
+    while frame:
+        filename = frame.f_code.co_filename
+        if not any(marker in filename for marker in _LIBRARY_MARKERS):
+            return f"{os.path.basename(filename)}:{frame.f_lineno} ({frame.f_code.co_name})"
+        frame = frame.f_back
+    return "unknown"
+
+
+def attach_profiler(driver):
+    """
+    Wraps driver.execute, through which every WebDriver command passes
+    (including WebElement calls such as get_attribute), to count and time each
+    command by type and call site.
+    """
+    original_execute = driver.execute
+
+    def execute(driver_command, params=None):
+        site = _call_site()
+        start = time.perf_counter()
+        try:
+            return original_execute(driver_command, params)
+        finally:
+            elapsed = time.perf_counter() - start
+            with _lock:
+                entry = _stats.setdefault((driver_command, site), [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+    driver.execute = execute
+    return driver
+
+
+def print_profile_summary(top=25):
+    """Prints WebDriver time per command type and the hottest call sites."""
+    if not _stats:
+        return
+    with _lock:
+        stats = dict(_stats)
+
+    total_calls = sum(entry[0] for entry in stats.values())
+    total_time = sum(entry[1] for entry in stats.values()) or 1e-9
+    print(f"\n[PROFILE] {total_calls} WebDriver commands, {total_time:.1f}s in round trips")
+
+    by_command = {}
+    for (command, _), (count, seconds, _) in stats.items():
+        entry = by_command.setdefault(command, [0, 0.0])
+        entry[0] += count
+        entry[1] += seconds
+    print("\n  By command:")
+    print(f"  {'command':<28} {'calls':>7} {'total s':>9} {'avg ms':>8} {'share':>6}")
+    for command, (count, seconds) in sorted(by_command.items(), key=lambda kv: -kv[1][1]):
+        print(f"  {command:<28} {count:>7} {seconds:>9.2f} {seconds / count * 1000:>8.1f} {seconds / total_time:>6.0%}")
+
+    print(f"\n  Top {top} call sites:")
+    print(f"  {'command':<24} {'call site':<48} {'calls':>7} {'total s':>9} {'avg ms':>8} {'max ms':>8}")
+    ranked = sorted(stats.items(), key=lambda kv: -kv[1][1])[:top]
+    for (command, site), (count, seconds, longest) in ranked:
+        print(f"  {command:<24} {site:<48} {count:>7} {seconds:>9.2f} {seconds / count * 1000:>8.1f} {longest * 1000:>8.1f}")
@@ -0,0 +1,138 @@
+import json
+import os
+
+import pytest
+
+from execution import archive_catalog
+from execution.archive_catalog import (
+    import_existing,
+    missing,
+    open_catalog,
+    record_discovered,
+    record_download,
+    search,
+)
+from execution.queue_lease import item_key
+from execution.tenant_config import OUTPUT_ROOT
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return str(tmp_path / "catalog.db")
+
+
+def item(n, title=None, course="CS 18000", module="Week 1", kind="video"):
+    return {
+        "url": f"https://school.example/d2l/le/content/12345/viewContent/{n}/View",
+        "title": title or f"Lecture {n}",
+        "type": kind,
+        "target_dir": os.path.join(OUTPUT_ROOT, "downloads", course, module, f"{kind}s"),
+    }
+
+
+def rows(catalog):
+    with open_catalog(catalog) as conn:
+        return {row["key"]: dict(row) for row in conn.execute("SELECT * FROM items")}
+
+
+def test_record_discovered_upserts_and_keeps_download_results(catalog, tmp_path):
+    lecture = item(1, "Lecture 1 (12:34)")
+    record_discovered([lecture], catalog)
+    row = rows(catalog)[item_key(lecture)]
+    assert (row["course"], row["module"], row["status"], row["duration"]) == ("CS 18000", "Week 1", "pending", 754)
+
+    path = tmp_path / "lecture1.pdf"
+    path.write_bytes(b"x" * 1000)
+    record_download(lecture, "done", str(path), 1000, catalog)
+
+    renamed = dict(lecture, title="Lecture 1: Recursion (12:34)")
+    record_discovered([renamed], catalog)
+    all_rows = rows(catalog)
+    assert len(all_rows) == 1
+    row = all_rows[item_key(lecture)]
+    assert row["title"] == "Lecture 1: Recursion (12:34)"
+    assert (row["status"], row["path"], row["size"]) == ("done", str(path), 1000)
+
+
+def test_record_download_inserts_unknown_items_and_keeps_path_on_failure(catalog, tmp_path):
+    lecture = item(2, kind="pdf")
+    path = tmp_path / "notes.pdf"
+    path.write_bytes(b"%PDF-1.4 notes")
+
+    record_download(lecture, "done", str(path), 14, catalog)
+    row = rows(catalog)[item_key(lecture)]
+    assert row["status"] == "done"
+    assert row["checksum"] == archive_catalog.file_checksum(str(path))
+    assert row["downloaded"] is not None
+
+    # A later failed attempt changes the status but not what is known about the file
+    record_download(lecture, "failed", None, None, catalog)
+    row = rows(catalog)[item_key(lecture)]
+    assert (row["status"], row["path"], row["size"]) == ("failed", str(path), 14)
+    assert row["checksum"] is not None
+
+
+def test_search_matches_word_prefixes_and_filters(catalog):
+    record_discovered([
+        item(1, "Recursion and Induction"),
+        item(2, "Sorting algorithms"),
+        item(3, "Recursive descent parsers", course="CS 35200"),
+        item(4, "Recursion worksheet", kind="pdf"),
+    ], catalog)
+
+    with open_catalog(catalog) as conn:
+        titles = {row["title"] for row in search(conn, "recur")}
+        assert titles == {"Recursion and Induction", "Recursive descent parsers", "Recursion worksheet"}
+        assert [row["title"] for row in search(conn, "recursion induction")] == ["Recursion and Induction"]
+        assert {row["title"] for row in search(conn, "recur", course="35200")} == {"Recursive descent parsers"}
+        assert {row["title"] for row in search(conn, "recur", item_type="pdf")} == {"Recursion worksheet"}
+        assert {row["title"] for row in search(conn, "week")} == {
+            "Recursion and Induction", "Sorting algorithms", "Recursive descent parsers", "Recursion worksheet"
+        }
+        assert search(conn, "graphs") == []
+
+
+def test_search_follows_renamed_titles(catalog):
+    lecture = item(5, "Lecture 5")
+    record_discovered([lecture], catalog)
+    record_discovered([dict(lecture, title="Hash tables")], catalog)
+
+    with open_catalog(catalog) as conn:
+        assert search(conn, "lecture") == []
+        assert [row["title"] for row in search(conn, "hash")] == ["Hash tables"]
+
+
+def test_missing_lists_undownloaded_and_vanished_files(catalog, tmp_path):
+    kept, gone, failed, pending = item(1), item(2), item(3), item(4, course="MA 26100")
+    record_discovered([kept, gone, failed, pending], catalog)
+    kept_path, gone_path = tmp_path / "kept.pdf", tmp_path / "gone.pdf"
+    kept_path.write_bytes(b"kept")
+    gone_path.write_bytes(b"gone")
+    record_download(kept, "done", str(kept_path), 4, catalog)
+    record_download(gone, "done", str(gone_path), 4, catalog)
+    record_download(failed, "failed", None, None, catalog)
+    gone_path.unlink()
+
+    with open_catalog(catalog) as conn:
+        assert {row["title"] for row in missing(conn)} == {"Lecture 3", "Lecture 4"}
+        assert {row["title"] for row in missing(conn, course="CS")} == {"Lecture 3"}
+        assert {row["title"] for row in missing(conn, verify=True)} == {"Lecture 2", "Lecture 3", "Lecture 4"}
+
+
+def test_import_fills_catalog_from_merged_status(catalog, tmp_path):
+    done, failed, pending = item(1), item(2), item(3)
+    path = tmp_path / "lecture1.mp4"
+    path.write_bytes(b"not really an mp4")
+    queue_file, status_file = tmp_path / "download_queue.json", tmp_path / "download_status.json"
+    queue_file.write_text(json.dumps([done, failed, pending]))
+    status_file.write_text(json.dumps({
+        item_key(done): {"status": "done", "path": str(path), "size": 17},
+        item_key(failed): {"status": "failed", "path": None},
+    }))
+
+    import_existing(catalog, str(queue_file), str(status_file), workers=2)
+    by_title = {row["title"]: row for row in rows(catalog).values()}
+    assert {title: row["status"] for title, row in by_title.items()} == {
+        "Lecture 1": "done", "Lecture 2": "failed", "Lecture 3": "pending"
+    }
+    assert by_title["Lecture 1"]["checksum"] == archive_catalog.file_checksum(str(path))
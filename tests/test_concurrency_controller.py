@@ -0,0 +1,78 @@
+import asyncio
+import copy
+import os
+
+import pytest
+
+from execution import retry_policy
+from execution.async_downloader import download_all
+from execution.concurrency_controller import AIMDController
+from execution.throttle_server import scale_backoff, start_server
+
+
+@pytest.fixture
+def fast_backoff():
+    """Retry delays of the throttle demo (2% of the real ones), restored afterwards."""
+    saved = copy.deepcopy(retry_policy.RETRY_POLICIES)
+    scale_backoff(0.02)
+    yield
+    for error_class, policy in saved.items():
+        retry_policy.RETRY_POLICIES[error_class].update(policy)
+
+
+def transfer(base_url, target_dir, controller, files, first=0):
+    jobs = [
+        {"media_url": f"{base_url}/files/{i}.pdf", "filename": os.path.join(target_dir, f"{i}.pdf"), "title": f"File {i}"}
+        for i in range(first, first + files)
+    ]
+    failed = []
+
+    def on_done(job, path, error, error_class, attempts, seconds):
+        if error:
+            failed.append(job["title"])
+
+    asyncio.run(download_all(jobs, None, controller.maximum, None, on_done, controller))
+    return failed
+
+
+def limits(controller, event=None):
+    return [d["limit"] for d in controller.decisions if event is None or d["event"] == event]
+
+
+def test_limit_drops_under_throttling_and_stays_in_bounds(tmp_path, fast_backoff):
+    server, base_url, stats = start_server(capacity=3, latency=0.02, file_kb=32)
+    controller = AIMDController("transfer", initial=24, minimum=2, maximum=24)
+    try:
+        transfer(base_url, str(tmp_path), controller, files=120)
+    finally:
+        server.shutdown()
+
+    assert stats.get(429, 0) + stats.get(503, 0) + stats.get(302, 0) > 0
+    assert limits(controller, "decrease")
+    assert min(limits(controller)) < 24
+    assert all(2 <= limit <= 24 for limit in limits(controller))
+    assert 2 <= controller.limit <= 24
+
+
+def test_limit_grows_again_once_throttling_stops(tmp_path, fast_backoff):
+    controller = AIMDController("transfer", initial=16, minimum=1, maximum=24)
+
+    server, base_url, _ = start_server(capacity=2, latency=0.02, file_kb=32)
+    try:
+        transfer(base_url, str(tmp_path), controller, files=80)
+    finally:
+        server.shutdown()
+    throttled_limit = int(controller.limit)
+    assert throttled_limit < 16
+
+    # Same controller against a server with room to spare
+    server, base_url, stats = start_server(capacity=200, latency=0.02, file_kb=32)
+    try:
+        failed = transfer(base_url, str(tmp_path), controller, files=300, first=1000)
+    finally:
+        server.shutdown()
+
+    assert failed == []
+    assert set(stats) & {429, 503, 302} == set()
+    assert int(controller.limit) > throttled_limit
+    assert max(limits(controller)) <= 24
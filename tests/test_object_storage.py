@@ -0,0 +1,129 @@
+import os
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from execution import object_storage
+from execution.tenant_config import OUTPUT_ROOT
+
+BUCKET = "archive"
+PART_SIZE = object_storage.MIN_PART_SIZE
+
+
+def pdf_bytes(size):
+    header = b"%PDF-1.4\n"
+    trailer = b"\n%%EOF\n"
+    filler = size - len(header) - len(trailer)
+    return header + bytes(i % 251 for i in range(filler)) + trailer
+
+
+class FakeResponse:
+    """Response of `body[offset:end]`, streamed and cut off after `limit` bytes if given."""
+
+    def __init__(self, body, offset=0, limit=None, end=None):
+        self.body = body[offset:end]
+        self.limit = limit
+        self.status_code = 206 if offset else 200
+        self.headers = {"Content-Length": str(len(self.body))}
+
+    @property
+    def content(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        end = len(self.body) if self.limit is None else self.limit
+        for start in range(0, end, chunk_size):
+            yield self.body[start:min(start + chunk_size, end)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Serves `body`; the first `cut_after` response (if given) breaks off after that many bytes."""
+
+    def __init__(self, body, cut_after=None):
+        self.body = body
+        self.cut_after = cut_after
+        self.ranges = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        byte_range = (headers or {}).get("Range")
+        self.ranges.append(byte_range)
+        if byte_range and byte_range.startswith("bytes=-"):
+            return FakeResponse(self.body, len(self.body) - int(byte_range[len("bytes=-"):]))
+        start, _, end = (byte_range or "bytes=0-")[len("bytes="):].partition("-")
+        limit, self.cut_after = self.cut_after, None
+        return FakeResponse(self.body, int(start), limit, int(end) + 1 if end else None)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "s3")
+    monkeypatch.setenv("S3_BUCKET", BUCKET)
+    monkeypatch.setenv("S3_PART_SIZE_MB", "5")
+    monkeypatch.setenv("S3_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.delenv("S3_ENDPOINT_URL", raising=False)
+    monkeypatch.delenv("S3_PREFIX", raising=False)
+    monkeypatch.setattr(object_storage, "_client", None)
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def target(name):
+    return os.path.join(OUTPUT_ROOT, "downloads", "Course", name)
+
+
+def stored(client, key):
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def test_streams_multipart_upload(s3):
+    body = pdf_bytes(2 * PART_SIZE + 12345)
+    url = object_storage.stream_to_object(FakeSession(body), "http://files/lecture.pdf", target("lecture.pdf"))
+
+    assert url == f"s3://{BUCKET}/downloads/Course/lecture.pdf"
+    assert stored(s3, "downloads/Course/lecture.pdf") == body
+    assert object_storage.check_stored(url, len(body)) == object_storage.COMPLETE
+
+
+def test_small_file_is_a_single_part(s3):
+    body = pdf_bytes(1000)
+    object_storage.stream_to_object(FakeSession(body), "http://files/notes.pdf", target("notes.pdf"))
+
+    assert stored(s3, "downloads/Course/notes.pdf") == body
+
+
+def test_resumes_after_last_full_part(s3):
+    body = pdf_bytes(2 * PART_SIZE + 777)
+    session = FakeSession(body, cut_after=PART_SIZE + 1000)
+
+    with pytest.raises(IOError, match="Incomplete download"):
+        object_storage.stream_to_object(session, "http://files/slides.pdf", target("slides.pdf"))
+    object_storage.stream_to_object(session, "http://files/slides.pdf", target("slides.pdf"))
+
+    assert session.ranges[1] == f"bytes={PART_SIZE}-"
+    assert stored(s3, "downloads/Course/slides.pdf") == body
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+
+
+def test_corrupt_stream_is_aborted(s3):
+    body = b"<html>Log in</html>" + b" " * 5000
+
+    with pytest.raises(IOError, match="failed verification"):
+        object_storage.stream_to_object(FakeSession(body), "http://files/broken.pdf", target("broken.pdf"))
+
+    assert s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", []) == []
+    assert object_storage.check_stored(f"s3://{BUCKET}/downloads/Course/broken.pdf") == object_storage.MISSING
@@ -0,0 +1,77 @@
+import queue
+
+import pytest
+
+from execution import watch_mode
+
+COURSE_URL = "https://school.example/d2l/home/12345"
+TENANT = {"base_url": "https://school.example"}
+
+
+@pytest.fixture
+def course(monkeypatch):
+    """A course whose fingerprint changed, with scan_course replaced by the test's `scans`."""
+    scans = []
+
+    def fake_scan(driver, course_url, found, use_toc, report_file=None):
+        result = scans.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        found.extend(result)
+        return "Course"
+
+    monkeypatch.setattr(watch_mode, "course_fingerprint", lambda *args: "api:new")
+    monkeypatch.setattr(watch_mode, "scan_course", fake_scan)
+    monkeypatch.setattr(watch_mode, "save_cache", lambda: None)
+    monkeypatch.setattr(watch_mode, "record_discovered", lambda items: None)
+    monkeypatch.setattr(watch_mode, "save_json", lambda path, data: None)
+    return scans
+
+
+def poll(entry, queue_items, work):
+    return watch_mode.check_course(None, None, "1.0", TENANT, COURSE_URL, entry, queue_items, set(), work, True)
+
+
+def lecture(n):
+    return {
+        "url": f"https://school.example/d2l/le/content/12345/viewContent/{n}/View",
+        "title": f"Lecture {n}",
+        "type": "video",
+        "target_dir": "downloads/Course/Week 1/videos",
+    }
+
+
+def test_failed_rescan_is_retried_on_next_poll(course):
+    entry = {"fingerprint": "api:old"}
+    queue_items, work = [], queue.Queue()
+    course.extend([RuntimeError("TOC timed out"), [lecture(1)]])
+
+    with pytest.raises(RuntimeError):
+        poll(entry, queue_items, work)
+    assert entry["fingerprint"] == "api:old"
+
+    poll(entry, queue_items, work)
+    assert entry["fingerprint"] == "api:new"
+    assert [item["title"] for item in queue_items] == ["Lecture 1"]
+    assert work.get_nowait()["title"] == "Lecture 1"
+
+
+def test_empty_rescan_keeps_old_fingerprint(course):
+    entry = {"fingerprint": "api:old"}
+    queue_items, work = [], queue.Queue()
+    course.extend([[], [lecture(2)]])
+
+    poll(entry, queue_items, work)
+    assert entry["fingerprint"] == "api:old"
+    assert "scanned" not in entry
+
+    poll(entry, queue_items, work)
+    assert entry["fingerprint"] == "api:new"
+    assert len(queue_items) == 1
+
+
+def test_unchanged_course_is_not_rescanned(course):
+    entry = {"fingerprint": "api:new"}
+
+    poll(entry, [], queue.Queue())
+    assert course == []  # scan_course was never called